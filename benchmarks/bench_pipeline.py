@@ -0,0 +1,282 @@
+# End-to-end benchmark of execute_script against a local mock of the OpenAlex
+# and OpenAI APIs, so it needs neither network access nor API spend.
+# Run from the repository root: python benchmarks/bench_pipeline.py --papers 1000 10000 50000
+#
+# The mock server generates a synthetic corpus on the fly: --papers works
+# spread evenly over --days, a --relevant share of them mentioning SOFCs and
+# a --positive share of those classified positive. Every corpus size runs in
+# its own subprocess and scratch directory, so the work store, model cache and
+# vector index start empty and peak memory is measured per run; --warm reruns
+# each size against the filled stores. The OpenAlex and token rate limits are
+# lifted unless --throttled is given. Tokenization needs the WordNet data
+# installed beforehand (python -m nltk.downloader wordnet).
+import argparse
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repository)
+
+corpus_start = datetime(2023, 1, 1)
+materials = [' anode', ' cathode', ' electrolyte', ' interconnect']
+
+class Corpus:
+    # Deterministic synthetic works; nothing is stored, every page is generated when requested
+    def __init__(self, papers, days, relevant_fraction, seed=0):
+        self.days = days
+        self.per_day = [papers // days + (1 if day < papers % days else 0) for day in range(days)]
+        self.relevant_fraction = relevant_fraction
+        rng = random.Random(seed)
+        vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(5000)]
+        self.abstracts = [self.inverted_index(rng, vocabulary, relevant=False) for _ in range(500)]
+        self.relevant_abstracts = [self.inverted_index(rng, vocabulary, relevant=True) for _ in range(500)]
+
+    def inverted_index(self, rng, vocabulary, relevant, words=180):
+        text = [rng.choice(vocabulary) for _ in range(words)]
+        if relevant:
+            position = rng.randrange(words - 4)
+            text[position:position + 4] = ['Solid', 'oxide', 'fuel', 'cells']
+        index = {}
+        for position, word in enumerate(text):
+            index.setdefault(word, []).append(position)
+        return index
+
+    def day_range(self, from_date, to_date):
+        first = max((datetime.strptime(from_date, "%Y-%m-%d") - corpus_start).days, 0)
+        last = min((datetime.strptime(to_date, "%Y-%m-%d") - corpus_start).days, self.days - 1)
+        return first, last
+
+    def count(self, from_date, to_date):
+        first, last = self.day_range(from_date, to_date)
+        return sum(self.per_day[first:last + 1])
+
+    def works(self, from_date, to_date, offset, limit, concept_ids):
+        # Newest first, like sort=publication_date:desc
+        first, last = self.day_range(from_date, to_date)
+        works = []
+        for day in range(last, first - 1, -1):
+            if offset >= self.per_day[day]:
+                offset -= self.per_day[day]
+                continue
+            for i in range(offset, self.per_day[day]):
+                works.append(self.work(day, i, concept_ids))
+                if len(works) == limit:
+                    return works
+            offset = 0
+        return works
+
+    def work(self, day, i, concept_ids):
+        date = (corpus_start + timedelta(days=day)).strftime("%Y-%m-%d")
+        key = day * 1000003 + i
+        relevant = (key * 7919) % 1000 < self.relevant_fraction * 1000
+        abstracts = self.relevant_abstracts if relevant else self.abstracts
+        return {
+            'id': f"https://openalex.org/W{day:04d}{i:07d}",
+            'doi': f"https://doi.org/10.5555/bench.{day}.{i}",
+            'title': f"Synthetic paper {i} of {date}",
+            'authorships': [{'author': {'display_name': f"Author {key % 97}"}}, {'author': {'display_name': f"Author {key % 89}"}}],
+            'publication_date': date,
+            'concepts': [{'id': f"https://openalex.org/{concept_id}", 'display_name': concept_id} for concept_id in concept_ids],
+            'abstract_inverted_index': abstracts[key % len(abstracts)],
+        }
+
+class MockAPI(BaseHTTPRequestHandler):
+    # GET /works for OpenAlex, POST /completions and /embeddings for OpenAI
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body):
+        data = json.dumps(body).encode('utf-8')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith('/works'):
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        works_filter = dict(part.split(':', 1) for part in query['filter'][0].split(','))
+        from_date, to_date = works_filter['from_publication_date'], works_filter['to_publication_date']
+        concept_ids = works_filter['concept.id'].split('|')
+        per_page = int(query.get('per_page', ['25'])[0])
+        count = self.server.corpus.count(from_date, to_date)
+        if per_page == 1:
+            self.send_json({'meta': {'count': count, 'next_cursor': None}, 'results': []})
+            return
+        cursor = query.get('cursor', ['*'])[0]
+        offset = 0 if cursor == '*' else int(cursor)
+        works = self.server.corpus.works(from_date, to_date, offset, per_page, concept_ids)
+        next_cursor = str(offset + len(works)) if offset + len(works) < count else None
+        self.send_json({'meta': {'count': count, 'next_cursor': next_cursor}, 'results': works})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path.endswith('/completions'):
+            from constants import sofc_model_name
+            prompts = request['prompt'] if isinstance(request['prompt'], list) else [request['prompt']]
+            choices = []
+            for i, prompt in enumerate(prompts):
+                key = zlib.crc32(prompt.encode('utf-8'))
+                if request['model'] == sofc_model_name:
+                    text = ' positive' if key % 1000 < self.server.positive_fraction * 1000 else ' negative'
+                else:
+                    text = materials[key % len(materials)]
+                choices.append({'text': text, 'index': i, 'logprobs': None, 'finish_reason': 'length'})
+            prompt_tokens = sum(len(prompt) // 4 + 1 for prompt in prompts)
+            self.send_json({'object': 'text_completion', 'model': request['model'], 'choices': choices, 'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(prompts), 'total_tokens': prompt_tokens + len(prompts)}})
+        elif self.path.endswith('/embeddings'):
+            texts = request['input'] if isinstance(request['input'], list) else [request['input']]
+            data = []
+            for i, text in enumerate(texts):
+                rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+                data.append({'object': 'embedding', 'index': i, 'embedding': rng.standard_normal(self.server.dimension, dtype=np.float32).round(6).tolist()})
+            tokens = sum(len(text) // 4 + 1 for text in texts)
+            self.send_json({'object': 'list', 'data': data, 'model': request['model'], 'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+        else:
+            self.send_error(404)
+
+def start_server(corpus, positive_fraction, dimension, latency):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockAPI)
+    server.daemon_threads = True
+    server.corpus = corpus
+    server.positive_fraction = positive_fraction
+    server.dimension = dimension
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        # No resource module on Windows; the worker traced Python allocations instead
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def worker(args):
+    # One execute_script run in the current directory against the mock server
+    try:
+        import resource
+    except ImportError:
+        import tracemalloc
+        tracemalloc.start()
+    os.environ['OPENAI_API_BASE'] = f"{args.server}/v1"
+    os.environ['OPENAI_API_KEY'] = 'benchmark'
+    import constants
+    # Overridden before any pipeline module binds the defaults
+    constants.openalex_base_url = args.server
+    if not args.throttled:
+        constants.openalex_requests_per_second = 1e9
+        constants.openai_tokens_per_minute = 1e12
+    import main
+    from constants import concept_list
+
+    class Recorder:
+        def __init__(self):
+            self.events = []
+
+        def post(self, kind, payload=None):
+            self.events.append((kind, payload))
+
+    main.app = Recorder()
+    from_date = corpus_start.strftime("%Y-%m-%d")
+    to_date = (corpus_start + timedelta(days=args.days - 1)).strftime("%Y-%m-%d")
+    started = time.perf_counter()
+    main.execute_script({'concepts': [concept_list[0][0]], 'from_publication_date': from_date, 'to_publication_date': to_date, 'target_embedding_word': 'perovskite'})
+    elapsed = time.perf_counter() - started
+
+    errors = [payload for kind, payload in main.app.events if kind == 'status' and str(payload).startswith('Error')]
+    if errors:
+        raise SystemExit(errors[0])
+    results = [payload for kind, payload in main.app.events if kind == 'results'][-1]
+    reports = sorted(name for name in os.listdir('runs') if name.endswith('.report.json'))
+    with open(os.path.join('runs', reports[-1])) as f:
+        report = json.load(f)
+    counters = report['counters']
+    with open(args.result, 'w') as f:
+        json.dump({
+            'seconds': elapsed,
+            'papers': counters.get('openalex.works', 0) + counters.get('fetch.rows_from_store', 0),
+            'positives': len(results),
+            'requests': counters.get('openalex.requests', 0) + counters.get('classify.requests', 0) + counters.get('embed.requests', 0),
+            'downloaded_mb': counters.get('openalex.bytes', 0) / 2 ** 20,
+            'peak_mb': peak_memory_mb(),
+            'stage_seconds': report['stage_seconds'],
+        }, f)
+
+def run_size(args, server, papers):
+    rows = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for run in ['cold', 'warm'] if args.warm else ['cold']:
+            result_file = os.path.join(scratch, f"{run}.json")
+            command = [sys.executable, os.path.abspath(__file__), '--worker', '--server', f"http://127.0.0.1:{server.server_port}", '--days', str(args.days), '--result', result_file]
+            if args.throttled:
+                command.append('--throttled')
+            server.corpus = Corpus(papers, args.days, args.relevant)
+            output = None if args.verbose else subprocess.DEVNULL
+            subprocess.run(command, cwd=scratch, stdout=output, check=True)
+            with open(result_file) as f:
+                result = json.load(f)
+            result.update(corpus=papers, run=run)
+            rows.append(result)
+            stages = '  '.join(f"{stage} {seconds:7.2f}" for stage, seconds in result['stage_seconds'].items())
+            print(f"{papers:>9,} {run:<5} {result['seconds']:8.2f} s {result['papers'] / result['seconds']:10,.0f} papers/s {result['positives']:>7,} positive {result['requests']:>7,} requests {result['downloaded_mb']:8.1f} MB down {result['peak_mb']:8.1f} MB peak   {stages}")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against a local mock of the OpenAlex and OpenAI APIs")
+    parser.add_argument('--papers', type=int, nargs='+', default=[1000, 10000], help='corpus sizes to run')
+    parser.add_argument('--days', type=int, default=30, help='days the corpus is spread over')
+    parser.add_argument('--relevant', type=float, default=0.2, help='share of papers that mention SOFCs')
+    parser.add_argument('--positive', type=float, default=0.5, help='share of relevant papers classified positive')
+    parser.add_argument('--dimension', type=int, default=1536, help='embedding dimension')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every mock API response')
+    parser.add_argument('--throttled', action='store_true', help='keep the OpenAlex and OpenAI rate limits from constants.py')
+    parser.add_argument('--warm', action='store_true', help='rerun every size against the filled work store and model cache')
+    parser.add_argument('--json', help='also write the results to this file, e.g. to compare two commits')
+    parser.add_argument('--verbose', action='store_true', help="show the pipeline's own output")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--server', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    server = start_server(None, args.positive, args.dimension, args.latency)
+    rows = []
+    try:
+        for papers in args.papers:
+            rows.extend(run_size(args, server, papers))
+    finally:
+        server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': {key: value for key, value in vars(args).items() if key not in ('worker', 'server', 'result', 'json', 'verbose')}, 'results': rows}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
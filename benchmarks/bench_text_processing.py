@@ -0,0 +1,114 @@
+# Micro-benchmark for abstract reconstruction, text cleaning, tokenization and
+# similarity ranking. Tokenization is skipped when WordNet is not installed.
+# Run from the repository root: python benchmarks/bench_text_processing.py --abstracts 100000
+# For the whole pipeline against mock APIs see bench_pipeline.py.
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data_fetching import abstract_from_inverted_index, remove_non_printable_chars
+from text_processing import clean_texts, KeywordMatcher, tokenize_texts, cosine_similarities, rank_by_score
+from constants import must_satisfy_keywords, stop_words
+
+def make_inverted_indexes(count, words_per_abstract, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(5000)]
+    vocabulary += ['SOFC', 'La0.6Sr0.4CoO3', '800°C', 'Ni–YSZ', 'α-phase']
+    indexes = []
+    for _ in range(count):
+        index = {}
+        for pos in range(words_per_abstract):
+            index.setdefault(rng.choice(vocabulary), []).append(pos)
+        indexes.append(index)
+    return indexes
+
+# Implementations as they were before the batch stage, kept for comparison
+def baseline_abstract_from_inverted_index(inverted_index):
+    word_positions = [(word, pos) for word, positions in inverted_index.items() for pos in positions]
+    word_positions.sort(key=lambda x: x[1])
+    return ' '.join(word for word, pos in word_positions)
+
+def baseline_remove_non_printable_chars(s):
+    return ''.join(filter(lambda x: x in string.printable, s))
+
+def baseline_clean_text(text):
+    text = re.sub(r'\W', ' ', text)
+    text = re.sub(r'\d', ' ', text)
+    return text
+
+def baseline_is_relevant(abstract):
+    return any(keyword in abstract.lower() for keyword in must_satisfy_keywords)
+
+def baseline_tokenize(text, lemmatizer):
+    return [lemmatizer.lemmatize(token) for token in text.split() if token not in stop_words]
+
+def baseline_rank(embeddings, target, top_k):
+    # One cosine_similarity call per row, then a full sort
+    scores = pd.Series([np.dot(row, target) / (np.linalg.norm(row) * np.linalg.norm(target)) for row in embeddings])
+    return scores.sort_values(ascending=False).index[:top_k].tolist()
+
+def timed(label, count, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f} s {count / elapsed:12,.0f} abstracts/s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--abstracts', type=int, default=100000)
+    parser.add_argument('--words', type=int, default=180, help='words per abstract')
+    parser.add_argument('--dimension', type=int, default=1536, help='embedding dimension for the ranking benchmark')
+    parser.add_argument('--top', type=int, default=200, help='papers kept by the ranking benchmark')
+    args = parser.parse_args()
+
+    indexes = make_inverted_indexes(args.abstracts, args.words)
+    n = len(indexes)
+
+    baseline = timed('baseline reconstruct', n, lambda: [baseline_abstract_from_inverted_index(index) for index in indexes])
+    abstracts = timed('reconstruct', n, lambda: [abstract_from_inverted_index(index) for index in indexes])
+    assert abstracts == baseline
+
+    baseline = timed('baseline remove_non_printable_chars', n, lambda: [baseline_remove_non_printable_chars(a) for a in abstracts])
+    abstracts = timed('remove_non_printable_chars', n, lambda: [remove_non_printable_chars(a) for a in abstracts])
+    assert abstracts == baseline
+
+    column = pd.Series(abstracts)
+    baseline = timed('baseline clean_text + lower (.apply)', n, lambda: column.apply(baseline_clean_text).apply(str.lower))
+    cleaned = timed('clean_texts', n, lambda: clean_texts(column))
+    assert cleaned.tolist() == baseline.tolist()
+
+    matcher = KeywordMatcher(must_satisfy_keywords)
+    baseline = timed('baseline is_relevant (.apply)', n, lambda: cleaned.apply(baseline_is_relevant))
+    relevant = timed('KeywordMatcher.matched_keywords', n, lambda: matcher.matched_keywords(cleaned).str.len() > 0)
+    assert relevant.tolist() == baseline.tolist()
+
+    try:
+        import nltk
+        nltk.data.find('corpora/wordnet')
+    except LookupError:
+        print("WordNet is not installed, skipping tokenization")
+    else:
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+        baseline = timed('baseline tokenize + lemmatize (.apply)', n, lambda: cleaned.apply(lambda text: baseline_tokenize(text, lemmatizer)))
+        tokens = timed('tokenize_texts', n, lambda: tokenize_texts(cleaned))
+        assert list(tokens) == baseline.tolist()
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((n, args.dimension), dtype=np.float32)
+    target = rng.standard_normal(args.dimension, dtype=np.float32)
+    baseline = timed('baseline similarity + sort_values', n, lambda: baseline_rank(embeddings, target, args.top))
+    ranked = timed('cosine_similarities + rank_by_score', n, lambda: rank_by_score(cosine_similarities(embeddings, target), args.top).tolist())
+    assert len(set(ranked) & set(baseline)) >= 0.99 * len(baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Headless entry point: runs the same pipeline as the GUI without Tk.
+#
+#   python cli.py run --concept "Materials Science" --concept Chemistry --from 2023-07-01 --to 2023-07-31 --query perovskite
+#   python cli.py search --query perovskite
+#   python cli.py index --build-ivf
+#
+# The pipeline modules (pandas, numpy, openai, nltk) are only imported once the
+# arguments have been parsed, so --help and argument errors return immediately.
+import argparse
+import re
+import sys
+from datetime import datetime
+
+from constants import concept_list, keyword_sets, search_top_k, output_format, output_directory, vector_index_ivf_lists
+
+def publication_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a YYYY-MM-DD date")
+    return value
+
+def concept_id(value):
+    # Accepts a concept name from constants.concept_list or an OpenAlex concept ID.
+    # IDs are returned in the form concept_list uses, since the work store keys coverage by them
+    for name, url in concept_list:
+        if value.lower() in (name.lower(), url.lower(), url.rsplit('/', 1)[-1].lower()):
+            return url
+    match = re.fullmatch(r'(https://openalex\.org/)?[cC](\d+)', value)
+    if match:
+        return f"https://openalex.org/c{match.group(2)}"
+    raise argparse.ArgumentTypeError(f"unknown concept {value!r}; choose from: {', '.join(name for name, url in concept_list)}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Find recent papers on OpenAlex, classify them and rank them against a query word.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="harvest, classify and rank papers for a date range")
+    run.add_argument('--concept', dest='concepts', type=concept_id, action='append', required=True, metavar='CONCEPT', help="concept name or OpenAlex ID; repeat for several")
+    run.add_argument('--from', dest='from_date', type=publication_date, required=True, metavar='DATE', help="first publication date (YYYY-MM-DD)")
+    run.add_argument('--to', dest='to_date', type=publication_date, required=True, metavar='DATE', help="last publication date (YYYY-MM-DD)")
+    run.add_argument('--query', required=True, help="word the positive papers are ranked against")
+    run.add_argument('--keywords', choices=sorted(keyword_sets), default='SOFC', help="keyword set for the relevance prefilter (default: SOFC)")
+    run.add_argument('--format', choices=['parquet', 'csv', 'jsonl', 'xlsx'], default=output_format, help=f"output format (default: {output_format}); rows are ranked by similarity_score once the run completes, and csv, jsonl and parquet stream unranked rows into <output>.partial until then")
+    run.add_argument('--output', help=f"where to write the papers (default: a new timestamped file in {output_directory}/)")
+    run.add_argument('--report', help="where to write the JSON run report (default: next to the output, with .report.json appended)")
+    run.add_argument('--profile', metavar='PATH', help="profile every pipeline stage with cProfile and write the merged stats here (read them with python -m pstats)")
+
+    # Only papers classified SOFC-positive reach the embed stage, so only those are in the vector index
+    search = commands.add_parser('search', help="rank the SOFC-positive papers of earlier runs against a query word")
+    search.add_argument('--query', required=True, help="word the indexed papers are ranked against")
+    search.add_argument('--top', type=int, default=search_top_k, help=f"number of papers to show (default: {search_top_k})")
+
+    index = commands.add_parser('index', help="show the vector index of SOFC-positive papers, or build its IVF layer")
+    index.add_argument('--build-ivf', action='store_true', help="cluster the index so searches only scan the closest clusters; rebuild after large runs")
+    index.add_argument('--lists', type=int, default=vector_index_ivf_lists, help=f"number of IVF clusters (default: {vector_index_ivf_lists})")
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'run':
+        if args.to_date < args.from_date:
+            print("--to must not be before --from", file=sys.stderr)
+            return 2
+        from pipeline import find_papers
+        find_papers(args.concepts, args.from_date, args.to_date, args.query, keyword_sets[args.keywords], output_format=args.format, output_path=args.output, report_path=args.report, profile_path=args.profile)
+    elif args.command == 'search':
+        from pipeline import search_papers
+        print(search_papers(args.query, args.top).to_string(index=False))
+    elif args.command == 'index':
+        from vector_index import VectorIndex
+        index = VectorIndex()
+        if args.build_ivf:
+            if not len(index):
+                print("The vector index is empty; find papers with the run command first", file=sys.stderr)
+                return 1
+            index.build_ivf(args.lists)
+            print(f"Built {len(index.centroids)} IVF lists over {len(index)} papers")
+        else:
+            mode = f"IVF with {len(index.centroids)} lists, {len(index) - len(index.assignments)} papers added since" if index.centroids is not None else "exhaustive search"
+            print(f"{len(index)} papers indexed ({mode})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,4 +30,61 @@ concept_list = [
 ]
 
 must_satisfy_keywords = ['solid oxide fuel cells', 'sofc', 'sofcs', 'solid-oxide fuel cells', 'solid oxide fuel cell', 'solid-oxide fuel cell', 'soec', 'soecs', 'solid oxide electrolyzer']
-stop_sequence = "\n"
\ No newline at end of file
+# Keyword sets the relevance prefilter can be run with; an abstract passes if it contains any keyword of the set
+keyword_sets = {
+    'SOFC': must_satisfy_keywords,
+}
+stop_sequence = "\n"
+
+lemma_cache_size = 200000  # memoized token -> lemma lookups
+tokenize_processes = 1  # > 1 gives the filter stage a process pool for tokenizing large chunks
+tokenize_parallel_threshold = 500  # chunks with fewer texts are tokenized in-process; pipeline chunks hold up to 2000 works
+tokenize_chunk_size = 250  # texts per process pool task
+tokenize_relevant_only = True  # only compute the Tokens column for papers that pass the keyword filter
+
+openalex_base_url = "https://api.openalex.org"
+openalex_requests_per_second = 10  # OpenAlex polite pool budget
+openalex_max_workers = 8
+openalex_request_timeout = 30
+openalex_max_retries = 6  # for server errors and dropped connections; a 429 waits for Retry-After instead
+openalex_target_window_size = 2000  # works per planned date window (10 cursor pages)
+
+work_store_path = "openalex_works.sqlite"
+work_store_settle_days = 30  # windows fetched this long after they ended are kept for good
+work_store_max_age_days = 1  # other windows are refetched after this long
+work_store_checkpoint_max_age_days = 14  # an interrupted window resumes from its saved cursor for this long, e.g. over a weekend
+work_store_chunk_size = 2000
+
+# Only the work fields the pipeline reads are requested from OpenAlex
+openalex_work_fields = ['id', 'doi', 'title', 'authorships', 'publication_date', 'abstract_inverted_index', 'concepts']
+
+separator = "\n\n###\n\n"
+sofc_model_name = "ada:ft-personal-2023-07-29-19-02-14"
+sofc_materials_model_name = "ada:ft-personal-2023-07-27-12-26-20"
+embedding_model_name = "text-embedding-ada-002"
+embedding_batch_size = 256  # inputs per embeddings request
+embedding_max_retries = 6  # for rate limits, server errors and dropped connections
+
+classification_batch_size = 20  # prompts per completion request
+classification_max_in_flight = 4  # concurrent completion requests
+classification_max_retries = 6
+openai_tokens_per_minute = 250000
+
+model_cache_path = "model_cache.sqlite"
+model_cache_max_bytes = 1024 ** 3  # 1 GB of cached values; a 1536-dimension embedding takes 6 KB, a prediction a few bytes
+model_cache_version = 1  # bump to invalidate every cached prediction and embedding, e.g. when prompts change
+
+vector_index_path = "vector_index"
+vector_index_block_size = 100000  # rows scored per matrix-vector product
+vector_index_ivf_lists = 1024
+vector_index_ivf_probes = 16
+search_top_k = 200  # papers shown by a search of the stored index
+
+output_directory = "runs"
+output_format = "csv"  # parquet (needs pyarrow), csv, jsonl or xlsx
+
+table_chunk_size = 500  # result rows inserted per Tk idle callback
+table_filter_delay_ms = 300
+table_tooltip_delay_ms = 150
+
+pipeline_queue_size = 4  # chunks buffered between pipeline stages
\ No newline at end of file
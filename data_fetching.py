@@ -1,77 +1,288 @@
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import random
 import string
+import threading
 import time
+from metrics import metrics
+from constants import openalex_base_url, openalex_requests_per_second, openalex_max_workers, openalex_request_timeout, openalex_max_retries, openalex_target_window_size, openalex_work_fields
+
+class RateLimiter:
+    # Token bucket shared by all harvesting threads. A 429 with Retry-After
+    # pauses every thread, not just the one that received it.
+    def __init__(self, rate=openalex_requests_per_second, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return
+                    wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def block_for(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.updated = self.blocked_until
+            self.tokens = 0
+
+def create_session(pool_size=openalex_max_workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_json(url, session=None, rate_limiter=None, max_retries=openalex_max_retries):
+    # Server errors and dropped connections are retried with the same jittered
+    # backoff as post_embeddings; a 429 does not use up an attempt
+    session = session or requests
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            with metrics.timer('openalex.rate_limit_wait'):
+                rate_limiter.acquire()
+        metrics.count('openalex.requests')
+        try:
+            started = time.perf_counter()
+            response = session.get(url, timeout=openalex_request_timeout)
+            metrics.observe('openalex.latency', time.perf_counter() - started)
+        except requests.exceptions.RequestException as e:
+            error = e
+        else:
+            metrics.count('openalex.bytes', len(response.content))
+            error = f"HTTP {response.status_code}" if response.status_code >= 500 else None
+        if error is not None:
+            metrics.count('openalex.errors')
+            if attempt == max_retries:
+                raise RuntimeError(f"OpenAlex request failed after {attempt + 1} attempts: {error}")
+            delay = random.uniform(0, min(60, 2 ** attempt))
+            attempt += 1
+            print(f"{error}, retrying OpenAlex request in {delay:.1f} seconds.")
+            metrics.count('openalex.retries')
+            time.sleep(delay)
+            continue
+
+        # Handle rate limiting - sleep if needed
+        if response.status_code == 429:
+            metrics.count('openalex.rate_limited')
+            metrics.count('openalex.retries')
+            retry_after = int(response.headers.get('Retry-After', 60))  # Default to 60 seconds if header is missing
+            print(f"Rate limit exceeded. Sleeping for {retry_after} seconds.")
+            if rate_limiter is not None:
+                rate_limiter.block_for(retry_after)
+            else:
+                time.sleep(retry_after)
+            continue  # Re-try the request after sleeping
+
+        if not response.ok:
+            metrics.count('openalex.errors')
+        response.raise_for_status()
+        return response.json()
 
 def generate_date_ranges(start_date_str, end_date_str):
     start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
     end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
-    
+
     while start_date <= end_date:
         yield start_date.strftime("%Y-%m-%d")
         start_date += timedelta(days=1)
 
+def concept_short_id(concept_id):
+    return concept_id.rsplit('/', 1)[-1].lower()
+
+def build_works_filter(concept_ids, from_date, to_date):
+    # concept_ids may be a single ID or a list of IDs, which OpenAlex ORs together
+    if isinstance(concept_ids, str):
+        concept_ids = [concept_ids]
+    concepts = '|'.join(concept_short_id(concept_id) for concept_id in concept_ids)
+    return f'concept.id:{concepts},from_publication_date:{from_date},to_publication_date:{to_date},has_abstract:true'
+
+def build_search_url(concept_ids, from_date, to_date, base_url=openalex_base_url):
+    return f'{base_url}/works?filter={build_works_filter(concept_ids, from_date, to_date)}&select={",".join(openalex_work_fields)}&sort=publication_date:desc'
+
 def abstract_from_inverted_index(inverted_index):
     if inverted_index is None:
         return "N/A"
-    word_positions = [(word, pos) for word, positions in inverted_index.items() for pos in positions]
-    word_positions.sort(key=lambda x: x[1])
-    abstract = ' '.join(word for word, pos in word_positions)
+    # Drop every word straight into its slot instead of sorting (word, pos) pairs
+    words = [None] * sum(map(len, inverted_index.values()))
+    try:
+        for word, positions in inverted_index.items():
+            for pos in positions:
+                words[pos] = word
+    except IndexError:
+        words = None
+    if words is None or None in words:
+        # Positions have gaps or are shared by several words; fall back to ordering them explicitly
+        word_positions = [(word, pos) for word, positions in inverted_index.items() for pos in positions]
+        word_positions.sort(key=lambda x: x[1])
+        return ' '.join(word for word, pos in word_positions)
+    abstract = ' '.join(words)
     return abstract
 
+# string.printable is pure ASCII, so drop everything else first and then the ASCII control characters
+non_printable_table = {code: None for code in range(128) if chr(code) not in string.printable}
+
 def remove_non_printable_chars(s):
     if s is None:
         return ""
-    return ''.join(filter(lambda x: x in string.printable, s))
+    return s.encode('ascii', 'ignore').decode('ascii').translate(non_printable_table)
 
-def get_total_papers_for_period(from_date, to_date, concept_id):
-    search_url = f'https://api.openalex.org/works?filter=concept.id:{concept_id},from_publication_date:{from_date},to_publication_date:{to_date}'
-    response = requests.get(search_url)
-    response.raise_for_status()
-    total_papers = response.json()["meta"]["count"]
+def get_total_papers_for_period(from_date, to_date, concept_ids, session=None, rate_limiter=None, base_url=openalex_base_url):
+    search_url = f'{base_url}/works?filter={build_works_filter(concept_ids, from_date, to_date)}&select=id&per_page=1'
+    metrics.count('openalex.count_queries')
+    total_papers = get_json(search_url, session, rate_limiter)["meta"]["count"]
     return total_papers
 
-def extract_papers_from_openalex_search(search_url, limit, current_date):
-    cursor = "*"
+def plan_date_windows(from_date, to_date, concept_ids, target_count=openalex_target_window_size, session=None, rate_limiter=None, base_url=openalex_base_url):
+    # Split the period until every window holds at most target_count works
+    # (or is a single day), then merge neighbours back together while they
+    # still fit. Returns [(from_date, to_date, count), ...] in date order.
+    start = datetime.strptime(from_date, "%Y-%m-%d")
+    end = datetime.strptime(to_date, "%Y-%m-%d")
+    if end < start:
+        return []
+
+    def count(window_start, window_end):
+        return get_total_papers_for_period(window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d"), concept_ids, session, rate_limiter, base_url)
+
+    windows = []
+    pending = [(start, end, count(start, end))]
+    while pending:
+        window_start, window_end, total = pending.pop()
+        days = (window_end - window_start).days + 1
+        if total <= target_count or days == 1:
+            windows.append((window_start, window_end, total))
+            continue
+        # Assume works are spread evenly and cut into as many pieces as the
+        # count suggests; uneven pieces get split again on the next pass.
+        pieces = min(days, -(-total // target_count))
+        piece_start = window_start
+        for i in range(pieces):
+            piece_end = window_start + timedelta(days=(days * (i + 1)) // pieces - 1)
+            pending.append((piece_start, piece_end, count(piece_start, piece_end)))
+            piece_start = piece_end + timedelta(days=1)
+
+    windows.sort()
+    merged = []
+    for window_start, window_end, total in windows:
+        if merged and merged[-1][2] + total <= target_count:
+            merged[-1] = (merged[-1][0], window_end, merged[-1][2] + total)
+        else:
+            merged.append((window_start, window_end, total))
+
+    return [(window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d"), total) for window_start, window_end, total in merged]
+
+def papers_from_works(works, concept_ids=None):
+    # Normalizes one page of OpenAlex works into pipeline rows. The last field
+    # lists which of the queried concept_ids the work is tagged with (all of its
+    # concepts without concept_ids), so a combined query can be split up again.
+    if isinstance(concept_ids, str):
+        concept_ids = [concept_ids]
+    papers = []
+    for work in works:
+        abstract = abstract_from_inverted_index(work.get('abstract_inverted_index'))
+        if abstract == "N/A":
+            continue
+
+        openalex_id = work['id']
+        doi = work['doi']
+        title = work['title']
+        authors = ', '.join([str(authorship['author'].get('display_name', 'Unknown Author')) for authorship in work['authorships']])
+        publication_date = work['publication_date']
+        concepts = ', '.join([concept['display_name'] for concept in work['concepts']])
+        if concept_ids is None:
+            work_concept_ids = ' '.join(concept['id'].lower() for concept in work['concepts'])
+        else:
+            tagged = {concept_short_id(concept['id']) for concept in work['concepts']}
+            # OpenAlex only returns works matching the filter, so fall back to every queried concept
+            work_concept_ids = ' '.join([concept_id for concept_id in concept_ids if concept_short_id(concept_id) in tagged] or concept_ids)
+        title = remove_non_printable_chars(title)
+        authors = remove_non_printable_chars(authors)
+        abstract = remove_non_printable_chars(abstract)
+        concepts = remove_non_printable_chars(concepts)
+        papers.append([openalex_id, doi, title, authors, publication_date, abstract, concepts, work_concept_ids])
+    return papers
+
+def extract_papers_from_openalex_search(search_url, limit, current_date, session=None, rate_limiter=None, cursor="*", on_page=None, concept_ids=None, cancel=None):
+    # Starts from cursor, e.g. one saved by an interrupted run; on_page(next_cursor, page_papers)
+    # is called after every page that has a next one, so it can be checkpointed.
+    # Once the cancel event is set no further page is requested.
     papers = []
     papers_fetched = 0  # Initialize counter_
 
     while len(papers) < limit:
+        if cancel is not None and cancel.is_set():
+            break
         url = f"{search_url}&per_page=200&cursor={cursor}"
-        response = requests.get(url)
-        
-        # Handle rate limiting - sleep if needed
-        if response.status_code == 429:
-            retry_after = int(response.headers.get('Retry-After', 60))  # Default to 60 seconds if header is missing
-            print(f"Rate limit exceeded. Sleeping for {retry_after} seconds.")
-            time.sleep(retry_after)
-            continue  # Re-try the request after sleeping
-        
-        response.raise_for_status()
+        data = get_json(url, session, rate_limiter)
 
-        works = response.json()["results"]
+        works = data["results"]
         papers_fetched += len(works)
-        
-        for work in works:
-            abstract = abstract_from_inverted_index(work['abstract_inverted_index']) if 'abstract_inverted_index' in work else "N/A"
-            if abstract == "N/A":
-                continue
-
-            doi = work['doi']
-            title = work['title']
-            authors = ', '.join([str(authorship['author'].get('display_name', 'Unknown Author')) for authorship in work['authorships']])
-            publication_date = work['publication_date']
-            concepts = ', '.join([concept['display_name'] for concept in work['concepts']])
-            title = remove_non_printable_chars(title)
-            authors = remove_non_printable_chars(authors)
-            abstract = remove_non_printable_chars(abstract)
-            concepts = remove_non_printable_chars(concepts)
-            papers.append([doi, title, authors, publication_date, abstract, concepts])
-        
+        metrics.count('openalex.pages')
+        metrics.count('openalex.works', len(works))
+
+        page_papers = papers_from_works(works, concept_ids)
+        papers.extend(page_papers)
+
         print(f"Fetched {papers_fetched} papers for {current_date}")
 
-        cursor = response.json()["meta"]["next_cursor"]
+        cursor = data["meta"]["next_cursor"]
         if cursor is None:
             break
+        if on_page is not None:
+            on_page(cursor, page_papers)
+
+    return papers
 
-    return papers
\ No newline at end of file
+def harvest_papers(jobs, limit, session=None, rate_limiter=None, max_workers=openalex_max_workers, base_url=openalex_base_url, cursors=None, on_page=None):
+    # jobs is an iterable of (concept_ids, from_date, to_date). Cursors run
+    # concurrently over one keep-alive session; (job, papers) pairs are
+    # yielded as soon as each cursor is exhausted. At most 2 * max_workers
+    # windows are in flight, so a slow consumer keeps memory bounded.
+    # cursors maps jobs to resume to their next cursor; on_page(job, next_cursor,
+    # page_papers) is called from the worker threads after every page.
+    # If a window fails or the generator is closed, queued windows are dropped
+    # and running cursors stop after their current page instead of being
+    # downloaded to the end.
+    cursors = cursors or {}
+    session = session or create_session(max_workers)
+    rate_limiter = rate_limiter or RateLimiter()
+    jobs = iter(jobs)
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {}
+        while True:
+            for job in jobs:
+                concept_ids, from_date, to_date = job
+                search_url = build_search_url(concept_ids, from_date, to_date, base_url)
+                label = from_date if from_date == to_date else f"{from_date} to {to_date}"
+                checkpoint = (lambda next_cursor, page_papers, job=job: on_page(job, next_cursor, page_papers)) if on_page is not None else None
+                futures[executor.submit(extract_papers_from_openalex_search, search_url, limit, label, session, rate_limiter, cursors.get(job, "*"), checkpoint, concept_ids, cancel)] = job
+                if len(futures) >= 2 * max_workers:
+                    break
+            if not futures:
+                break
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield futures.pop(future), future.result()
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
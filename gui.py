@@ -3,119 +3,231 @@ from tkinter import ttk
 from ttkthemes import ThemedTk
 from tkinter import PhotoImage
 import queue
-from Constants import concept_list
+import pandas as pd
+from constants import concept_list, table_chunk_size, table_filter_delay_ms, table_tooltip_delay_ms
 import threading
 
+class ToolTip(object):
+        # A single tooltip window that is moved and relabelled instead of being recreated on every mouse move
+        def __init__(self, widget):
+                self.widget = widget
+                self.tipwindow = None
+                self.label = None
+                self.text = None
+
+        def showtip(self, text):
+                if not text:
+                        self.hidetip()
+                        return
+                if self.tipwindow is None:
+                        self.tipwindow = tw = tk.Toplevel(self.widget)
+                        tw.wm_overrideredirect(1)
+                        self.label = tk.Label(tw, justify=tk.LEFT,
+                                        background="#ffffe0", relief=tk.SOLID, borderwidth=1,
+                                        font=("tahoma", "8", "normal"))
+                        self.label.pack(ipadx=1)
+                if text != self.text:
+                        self.text = text
+                        self.label.config(text=text)
+                x = self.widget.winfo_pointerx()
+                y = self.widget.winfo_pointery() + 20
+                self.tipwindow.wm_geometry("+%d+%d" % (x, y))
+                self.tipwindow.deiconify()
+
+        def hidetip(self):
+                if self.tipwindow is not None:
+                        self.tipwindow.withdraw()
+
+class ResultsTable:
+        # Treeview backed by a DataFrame. Rows are inserted in chunks scheduled
+        # with after() so large results never freeze the window; headings sort
+        # and the filter box narrows the DataFrame, not the widget.
+        def __init__(self, parent, root, copy_to_clipboard):
+                self.root = root
+                self.data = pd.DataFrame()
+                self.view = self.data
+                self.sort_column = None
+                self.sort_ascending = True
+                self.fill_generation = 0
+                self.filled = 0
+                self.filling = False
+                self.filter_job = None
+                self.tooltip_job = None
+                self.tooltip_cell = None
+                self.last_motion = None
+
+                self.frame = ttk.Frame(parent)
+
+                filter_frame = ttk.Frame(self.frame)
+                filter_frame.pack(side=tk.TOP, fill=tk.X)
+                ttk.Label(filter_frame, text="Filter:").pack(side=tk.LEFT, padx=5, pady=5)
+                self.filter_var = tk.StringVar()
+                self.filter_var.trace_add("write", lambda *args: self.schedule_filter())
+                ttk.Entry(filter_frame, textvariable=self.filter_var, width=40).pack(side=tk.LEFT, padx=5, pady=5)
+                self.count_label = ttk.Label(filter_frame, text="")
+                self.count_label.pack(side=tk.LEFT, padx=5, pady=5)
+
+                # Create a treeview widget
+                self.tree = tree = ttk.Treeview(self.frame, show='headings')
+
+                # Create scrollbars
+                vsb = ttk.Scrollbar(self.frame, orient="vertical", command=tree.yview)
+                vsb.pack(side=tk.RIGHT, fill=tk.Y)
+                hsb = ttk.Scrollbar(self.frame, orient="horizontal", command=tree.xview)  # Horizontal Scrollbar
+                hsb.pack(side=tk.BOTTOM, fill=tk.X)
+
+                tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)  # Link the horizontal scrollbar to the tree
+                tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
+
+                # Right-click context menu
+                context_menu = tk.Menu(tree, tearoff=0)
+                context_menu.add_command(label="Copy", command=lambda: copy_to_clipboard(tree))
+
+                def display_context_menu(event):
+                        tree.selection_set(tree.identify_row(event.y))
+                        context_menu.post(event.x_root, event.y_root)
+
+                tree.bind("<Button-2>", display_context_menu)  # Bind right-click
+
+                self.tooltip = ToolTip(tree)
+                tree.bind('<Motion>', self.on_motion)
+                tree.bind('<Leave>', lambda e: self.hide_tooltip())
+
+        def set_columns(self, columns):
+                self.tree.configure(columns=columns)
+                for col in columns:
+                        self.tree.column(col, anchor=tk.W, width=100, stretch=tk.YES)  # Set stretch=tk.YES to make the column resizable
+                        self.tree.heading(col, text=col, anchor=tk.W, command=lambda c=col: self.sort_by(c))
+
+        def set_data(self, data_frame):
+                if list(data_frame.columns) != list(self.data.columns):
+                        self.set_columns(data_frame.columns.tolist())
+                        self.sort_column = None
+                self.data = data_frame.reset_index(drop=True)
+                self.refresh()
+
+        def append(self, data_frame):
+                self.data = pd.concat([self.data, data_frame], ignore_index=True)
+                if self.sort_column is None and not self.filter_var.get():
+                        # Nothing to re-sort or re-filter: only the new rows need inserting,
+                        # which a fill that is still running picks up by itself
+                        self.view = self.data
+                        if not self.filling:
+                                self.fill(self.fill_generation, self.filled)
+                else:
+                        self.refresh()
+
+        def schedule_filter(self):
+                if self.filter_job is not None:
+                        self.root.after_cancel(self.filter_job)
+                self.filter_job = self.root.after(table_filter_delay_ms, self.refresh)
+
+        def sort_by(self, column):
+                self.sort_ascending = not self.sort_ascending if self.sort_column == column else True
+                self.sort_column = column
+                self.refresh()
+
+        def refresh(self):
+                self.filter_job = None
+                view = self.data
+                text = self.filter_var.get().strip().lower()
+                if text:
+                        matches = pd.Series(False, index=view.index)
+                        for col in view.columns:
+                                matches |= view[col].astype(str).str.lower().str.contains(text, regex=False)
+                        view = view[matches]
+                if self.sort_column is not None:
+                        view = view.sort_values(self.sort_column, ascending=self.sort_ascending, kind='stable')
+                self.view = view
+
+                # Any fill still running belongs to the old view
+                self.fill_generation += 1
+                self.tree.delete(*self.tree.get_children())
+                self.filling = False
+                self.fill(self.fill_generation, 0)
+
+        def fill(self, generation, start):
+                if generation != self.fill_generation:
+                        return
+                chunk = self.view.iloc[start:start + table_chunk_size]
+                for row in chunk.itertuples(index=False):
+                        self.tree.insert("", tk.END, values=[f"{value:.4f}" if pd.api.types.is_float(value) else value for value in row])
+                end = start + len(chunk)
+                self.filled = end
+                self.count_label.config(text=f"{end} of {len(self.view)} rows shown ({len(self.data)} total)")
+                self.filling = end < len(self.view)
+                if self.filling:
+                        self.root.after(1, self.fill, generation, end)
+
+        def on_motion(self, event):
+                # Only the latest pointer position is looked at, at most every table_tooltip_delay_ms
+                self.last_motion = (event.x, event.y)
+                if self.tooltip_job is None:
+                        self.tooltip_job = self.root.after(table_tooltip_delay_ms, self.update_tooltip)
+
+        def update_tooltip(self):
+                self.tooltip_job = None
+                if self.last_motion is None:
+                        return
+                x, y = self.last_motion
+                row_id = self.tree.identify_row(y)
+                col_id = self.tree.identify_column(x)
+                if not (row_id and col_id):
+                        self.tooltip_cell = None
+                        self.tooltip.hidetip()
+                        return
+                if (row_id, col_id) != self.tooltip_cell:
+                        self.tooltip_cell = (row_id, col_id)
+                        self.tooltip.showtip(self.tree.set(row_id, col_id))
+
+        def hide_tooltip(self):
+                self.last_motion = None
+                self.tooltip_cell = None
+                self.tooltip.hidetip()
+
 class GUI:
-        def __init__(self, execute_script):
+        def __init__(self, execute_script, search_papers=None):
                 # Initializing attributes
                 self.update_queue = queue.Queue()
                 self.root = None
                 self.execute_script = execute_script
+                self.search_papers = search_papers
 
                 self.execute_button = None
+                self.search_button = None
                 self.canvas = None
                 self.progress_percentage_label = None
                 self.current_date_label = None
                 self.progress_bar = None
                 self.status_label = None
+                self.timing_label = None
                 self.concept_id_entry = None
                 self.from_publication_date_entry = None
                 self.to_publication_date_entry = None
                 self.target_embedding_word_entry = None
                 self.main_frame = None
+                self.results_table = None
+                self.new_run = False
+                self.busy = False
                 self.additional_image = None
                 self.resized_image = None
 
                 self.initialize_gui()
 
         def show_data(self, data_frame, main_frame, root):
-                # Create a new frame for the table
-                table_frame = ttk.Frame(self.main_frame)
-                table_frame.grid(row=3, column=0, sticky=tk.W+tk.E)
-
-                # Create a treeview widget
-                tree = ttk.Treeview(table_frame, columns=data_frame.columns.tolist(), show='headings')
-
-                # Create scrollbars
-                vsb = ttk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
-                vsb.pack(side=tk.RIGHT, fill=tk.Y)
-                hsb = ttk.Scrollbar(table_frame, orient="horizontal", command=tree.xview)  # Horizontal Scrollbar
-                hsb.pack(side=tk.BOTTOM, fill=tk.X)
-
-                tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)  # Link the horizontal scrollbar to the tree
-
-                # Create the columns
-                for col in data_frame.columns:
-                        tree.column(col, anchor=tk.W, width=150, stretch=tk.YES)  # Set stretch=tk.YES to make the column resizable
-                        tree.heading(col, text=col, anchor=tk.W)
-
-                # Insert the data
-                for index, row in data_frame.iterrows():
-                        tree.insert("", index, values=row.tolist())
+                # One table is reused for every run; rows are inserted a chunk at a time from the Tk main loop
+                if self.results_table is None:
+                        self.results_table = ResultsTable(self.main_frame, self.root, self.copy_to_clipboard)
+                        self.results_table.frame.grid(row=6, column=0, columnspan=2, sticky=tk.W+tk.E)
+                self.results_table.set_data(data_frame)
 
-                # Adjust column widths
-                self.adjust_column_width(tree, data_frame.columns)
-
-                tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
-
-                def on_treeview_click(event):
-                        print("Treeview clicked!")
-
-                tree.bind("<Button-1>", on_treeview_click)
-
-                # Right-click context menu
-                context_menu = tk.Menu(tree, tearoff=0)
-                context_menu.add_command(label="Copy", command=lambda: self.copy_to_clipboard(tree))
-
-                def display_context_menu(event):
-                        tree.selection_set(tree.identify_row(event.y))
-                        print("Right-click detected!")  # Debugging print statement
-                        context_menu.post(event.x_root, event.y_root)
-
-                tree.bind("<Button-2>", display_context_menu)  # Bind right-click
-
-                class ToolTip(object):
-                        def __init__(self, widget):
-                                self.widget = widget
-                                self.tipwindow = None
-                                self.id = None
-                                self.x = self.y = 0
-
-                        def showtip(self, text):
-                                self.text = text
-                                if self.tipwindow or not self.text:
-                                        return
-                                x = self.widget.winfo_pointerx()
-                                y = self.widget.winfo_pointery() + 20
-                                self.tipwindow = tw = tk.Toplevel(self.widget)
-                                tw.wm_overrideredirect(1)
-                                tw.wm_geometry("+%d+%d" % (x, y))
-                                label = tk.Label(tw, text=self.text, justify=tk.LEFT,
-                                                background="#ffffe0", relief=tk.SOLID, borderwidth=1,
-                                                font=("tahoma", "8", "normal"))
-                                label.pack(ipadx=1)
-                        
-                        def hidetip(self):
-                            tw = self.tipwindow
-                            self.tipwindow = None
-                            if tw:
-                                tw.destroy()
-
-                tooltip = ToolTip(tree)
-
-                def motion(event):
-                        row_id = tree.identify_row(event.y)
-                        col_id = tree.identify_column(event.x)
-
-                        if row_id and col_id:
-                                cell_text = tree.set(row_id, col_id)
-                                tooltip.showtip(cell_text)
-                        else:
-                                tooltip.hidetip()
-
-                tree.bind('<Motion>', motion)
-                tree.bind('<Leave>', lambda e: tooltip.hidetip())
+        def append_data(self, data_frame):
+                # Partial results while the pipeline is still running
+                if self.new_run or self.results_table is None or list(self.results_table.data.columns) != list(data_frame.columns):
+                        self.new_run = False
+                        self.show_data(data_frame, self.main_frame, self.root)
+                else:
+                        self.results_table.append(data_frame)
 
 
         def on_mousewheel(self, event):
@@ -136,17 +248,76 @@ class GUI:
                 for col in columns:
                         tree.column(col, width=width)
 
-        def update_progress_bar(self, percentage, progress_var, progress_percentage_label):
+        def update_progress_bar(self, percentage):
             self.progress_var.set(percentage)
             self.progress_percentage_label.config(text=f"{int(percentage)}%")
 
+        def post(self, kind, payload=None):
+                # Called from worker threads: events are only applied to widgets by check_queue on the Tk main loop
+                self.update_queue.put((kind, payload))
+
+        def set_buttons_state(self, state):
+                self.execute_button.config(state=state)
+                if self.search_button is not None:
+                        self.search_button.config(state=state)
+
+        def run_in_background(self, task):
+                # Only one task runs at a time: a run and a search share the metrics,
+                # the token budget, the vector index and the results table.
+                # Widgets are read here on the main loop; the task only ever sees plain values
+                if self.busy:
+                        return
+                self.busy = True
+                self.set_buttons_state(tk.DISABLED)
+                self.new_run = True
+                inputs = {
+                        'concepts': [self.concept_id_entry.get(idx) for idx in self.concept_id_entry.curselection()],
+                        'from_publication_date': self.from_publication_date_entry.get(),
+                        'to_publication_date': self.to_publication_date_entry.get(),
+                        'target_embedding_word': self.target_embedding_word_entry.get(),
+                }
+                threading.Thread(target=task, args=(inputs,), daemon=True).start()
+
         def check_queue(self):
+                # Drain everything that arrived since the last tick, but only redraw
+                # the latest progress, status and timings so a fast harvest never
+                # waits on the UI.
+                latest = {}
+                results = []
+                partial = []
+                done = False
                 try:
-                        progress = self.update_queue.get_nowait()
-                        self.update_progress_bar(progress)
-                        print(f"Progress from queue: {progress}")
+                        while True:
+                                kind, payload = self.update_queue.get_nowait()
+                                if kind == 'results':
+                                        results = [payload]
+                                        partial = []
+                                elif kind == 'partial':
+                                        partial.append(payload)
+                                elif kind == 'done':
+                                        done = True
+                                else:
+                                        latest[kind] = payload
                 except queue.Empty:
                         pass
+
+                if 'progress' in latest:
+                        percentage, text = latest['progress']
+                        self.update_progress_bar(percentage)
+                        self.current_date_label.config(text=text)
+                if 'status' in latest:
+                        self.status_label.config(text=latest['status'])
+                if 'timings' in latest:
+                        self.timing_label.config(text=", ".join(f"{stage}: {seconds:.1f}s" for stage, seconds in latest['timings'].items()))
+                if partial:
+                        self.append_data(pd.concat(partial, ignore_index=True))
+                        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+                for data_frame in results:
+                        self.show_data(data_frame, self.main_frame, self.root)
+                        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+                if done and self.busy:
+                        self.busy = False
+                        self.set_buttons_state(tk.NORMAL)
                 self.root.after(100, self.check_queue)
 
         def initialize_gui(self):
@@ -217,9 +388,14 @@ class GUI:
                 self.target_embedding_word_entry.grid(row=3, column=1, sticky=tk.E, padx=5, pady=5)
 
                 # Execute Button and Status Label
-                self.execute_button = ttk.Button(self.main_frame, text="Execute Script", command=lambda: threading.Thread(target=self.execute_script).start())
+                self.execute_button = ttk.Button(self.main_frame, text="Execute Script", command=lambda: self.run_in_background(self.execute_script))
                 self.execute_button.grid(row=1, column=0, pady=10)
 
+                # Ranks the papers of earlier runs against the target word without fetching anything
+                if self.search_papers is not None:
+                        self.search_button = ttk.Button(self.main_frame, text="Search Past SOFC Positives", command=lambda: self.run_in_background(self.search_papers))
+                        self.search_button.grid(row=1, column=1, pady=10)
+
                 # Status Label to show which date is currently being processed
                 self.current_date_label = ttk.Label(self.main_frame, text="")
                 self.current_date_label.grid(row=2, column=0, pady=10)
@@ -235,6 +411,10 @@ class GUI:
                 self.progress_percentage_label = ttk.Label(self.main_frame, text="0%")
                 self.progress_percentage_label.grid(row=4, column=1)
 
+                # Time spent in each pipeline stage so far
+                self.timing_label = ttk.Label(self.main_frame, text="")
+                self.timing_label.grid(row=5, column=0, pady=10)
+
                 self.check_queue()
 
                 return self.root, self.execute_button, self.canvas, self.progress_percentage_label, self.current_date_label, self.progress_bar, self.status_label, self.concept_id_entry, self.from_publication_date_entry, self.to_publication_date_entry, self.target_embedding_word_entry, self.main_frame, self.additional_image, self.resized_image
\ No newline at end of file
@@ -0,0 +1,127 @@
+import bisect
+import cProfile
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Latency bucket upper bounds in seconds; the last bucket takes everything slower
+latency_buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+class Histogram:
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + [self.max], self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def report(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': round(self.max, 6),
+            'buckets': {f"le_{bound}": count for bound, count in zip(self.buckets + ['inf'], self.counts)},
+        }
+
+class RunMetrics:
+    # Counters and latency histograms for one run, named "<stage>.<what>", e.g.
+    # openalex.requests or classify.rows_out. Safe to update from every pipeline
+    # thread. With profiling on, each stage thread runs under its own cProfile
+    # profiler and the profiles are merged when the report is written.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, profiling=False):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.profiling = profiling
+            self.profiles = []
+            self.started = time.perf_counter()
+            self.started_at = datetime.now().isoformat(timespec='seconds')
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def profiled(self, function):
+        # Thread target wrapper; runs function under its own profiler when profiling is on
+        def run(*args, **kwargs):
+            if not self.profiling:
+                return function(*args, **kwargs)
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(function, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.profiles.append(profiler)
+        return run
+
+    def cache_hit_rates(self):
+        rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith('.cache_hits'):
+                stage = name[:-len('.cache_hits')]
+                lookups = hits + self.counters.get(f"{stage}.cache_misses", 0)
+                rates[stage] = round(hits / lookups, 4) if lookups else None
+        return rates
+
+    def report(self, **extra):
+        with self.lock:
+            report = {
+                'started_at': self.started_at,
+                'wall_seconds': round(time.perf_counter() - self.started, 3),
+                **extra,
+                'counters': dict(sorted(self.counters.items())),
+                'latency_seconds': {name: histogram.report() for name, histogram in sorted(self.histograms.items())},
+            }
+        report['cache_hit_rates'] = self.cache_hit_rates()
+        return report
+
+    def write_report(self, path, profile_path=None, **extra):
+        with open(path, 'w') as f:
+            json.dump(self.report(**extra), f, indent=2)
+        if profile_path is not None and self.profiles:
+            stats = pstats.Stats(*self.profiles)
+            stats.dump_stats(profile_path)
+
+# Shared by the fetching, model and pipeline modules; run_pipeline resets it at the start of every run
+metrics = RunMetrics()
@@ -0,0 +1,69 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from constants import model_cache_path, model_cache_max_bytes, model_cache_version
+
+class ModelCache:
+    # Persistent cache of model outputs keyed by hash(cache version, model name,
+    # input text). Changing the model name or model_cache_version misses every
+    # old entry; those are evicted least-recently-used first once the cached
+    # values take up more than max_bytes. Safe to share between pipeline threads.
+    def __init__(self, path=model_cache_path, max_bytes=model_cache_max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, model TEXT, value BLOB, last_used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self.total_bytes = self.connection.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def key(self, model_name, text):
+        return hashlib.sha256(f"{model_cache_version}\0{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, model_name, texts):
+        # Returns the cached value (bytes) for every text, or None where there is none
+        keys = [self.key(model_name, text) for text in texts]
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.connection.execute(f'SELECT key, value FROM entries WHERE key IN ({",".join("?" * len(batch))})', batch)
+                found.update(rows)
+            if found:
+                with self.connection:
+                    now = time.time()
+                    self.connection.executemany('UPDATE entries SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model_name, texts, values):
+        now = time.time()
+        rows = {self.key(model_name, text): (model_name, value, now) for text, value in zip(texts, values)}
+        with self.lock, self.connection:
+            keys = list(rows)
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                replaced = self.connection.execute(f'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries WHERE key IN ({",".join("?" * len(batch))})', batch).fetchone()[0]
+                self.total_bytes -= replaced
+            self.connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', [(key, *row) for key, row in rows.items()])
+            self.total_bytes += sum(len(value) for _, value, _ in rows.values())
+            if self.total_bytes > self.max_bytes:
+                # Least recently used first, until the values fit again
+                evicted = []
+                freed = 0
+                for key, size in self.connection.execute('SELECT key, LENGTH(value) FROM entries ORDER BY last_used'):
+                    if self.total_bytes - freed <= self.max_bytes:
+                        break
+                    evicted.append((key,))
+                    freed += size
+                self.connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+                self.total_bytes -= freed
+
+    def invalidate(self, model_name):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM entries WHERE model = ?', (model_name,))
+            self.total_bytes = self.connection.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries').fetchone()[0]
@@ -0,0 +1,316 @@
+import queue
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+import pandas as pd
+
+from data_fetching import plan_date_windows, get_total_papers_for_period, harvest_papers, create_session, RateLimiter
+from text_processing import clean_texts, tokenize_texts, create_tokenize_pool, KeywordMatcher, run_prediction, get_embedding, get_embeddings, cosine_similarities, rank_by_score
+from work_store import WorkStore
+from model_cache import ModelCache
+from vector_index import VectorIndex
+from writers import writers, open_writer, output_file_path
+from metrics import metrics
+from constants import openalex_base_url, keyword_sets, separator, sofc_model_name, sofc_materials_model_name, pipeline_queue_size, tokenize_relevant_only, embedding_model_name, output_format
+
+paper_columns = ["OpenAlex ID", "DOI", "Title", "Authors", "Publication Date", "Abstract", "Concepts", "Concept IDs"]
+search_columns = ["DOI", "Title", "Publication Date", "similarity_score"]
+result_columns = ["DOI", "Title", "Matched Keywords", "SOFC Predictions", "SOFC Materials Predictions", "similarity_score"]
+
+# Passed down the stages after the last chunk; an exception is passed down the same way
+end_of_stream = object()
+
+def put(outbox, item, stop):
+    # Blocks while the next stage is busy, but gives up once the run is stopped
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def get(inbox, stop):
+    while not stop.is_set():
+        try:
+            return inbox.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return end_of_stream
+
+def run_stage(function, inbox, outbox, stop, timings=None, name=None):
+    try:
+        while True:
+            chunk = get(inbox, stop)
+            if chunk is end_of_stream or isinstance(chunk, Exception):
+                put(outbox, chunk, stop)
+                return
+            started = time.perf_counter()
+            result = function(chunk)
+            elapsed = time.perf_counter() - started
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+            metrics.observe(f"{name}.chunk_latency", elapsed)
+            metrics.count(f"{name}.rows_in", len(chunk))
+            metrics.count(f"{name}.rows_out", len(result))
+            if len(result) and not put(outbox, result, stop):
+                return
+    except Exception as e:
+        put(outbox, e, stop)
+
+def fetch_papers(concept_ids, from_date, to_date, outbox, stop, on_progress=None, base_url=openalex_base_url, timings=None):
+    # Source stage: works already in the local store first, then every missing window from OpenAlex.
+    # Days missing several concepts are fetched with one combined query, and a work
+    # tagged with more than one of the concepts is only passed downstream once.
+    store = None
+    started = time.perf_counter()
+    try:
+        store = WorkStore()
+        session = create_session()
+        rate_limiter = RateLimiter()
+
+        # Windows an interrupted run left unfinished resume from their saved cursor.
+        # Plan date windows of roughly equal size for every other range the local store is missing; their counts add up to the total still to download
+        jobs = []
+        cursors = {}
+        total_papers_for_period = 0
+        for missing_concepts, range_from, range_to in store.missing_concept_ranges(concept_ids, from_date, to_date):
+            for window_from, window_to, next_cursor, papers_fetched in store.unfinished_windows(missing_concepts, range_from, range_to):
+                job = (missing_concepts, window_from, window_to)
+                jobs.append(job)
+                cursors[job] = next_cursor
+                total_papers_for_period += max(get_total_papers_for_period(window_from, window_to, missing_concepts, session, rate_limiter, base_url) - papers_fetched, 0)
+            for missing_from, missing_to in store.missing_ranges(missing_concepts, range_from, range_to, include_unfinished=True):
+                for window_from, window_to, window_count in plan_date_windows(missing_from, missing_to, missing_concepts, session=session, rate_limiter=rate_limiter, base_url=base_url):
+                    if window_count:
+                        jobs.append((missing_concepts, window_from, window_to))
+                    else:
+                        store.save_window(missing_concepts, window_from, window_to, [])
+                    total_papers_for_period += window_count
+        print(f"Total papers to download for period: {total_papers_for_period}")  # Debug print
+        print(f"Fetching papers in {len(jobs)} date windows, resuming {len(cursors)}...")
+
+        # An exact set is small next to the works themselves (about 100 bytes per ID), even for millions of works
+        seen_ids = set()
+        seen_dois = set()
+
+        def send(papers):
+            # Drops works already sent, e.g. tagged with two of the concepts or listed under two OpenAlex IDs with one DOI
+            unseen = []
+            for paper in papers:
+                doi = paper[1].lower() if paper[1] else None
+                if paper[0] in seen_ids or doi in seen_dois:
+                    continue
+                seen_ids.add(paper[0])
+                if doi is not None:
+                    seen_dois.add(doi)
+                unseen.append(paper)
+            metrics.count('fetch.duplicates', len(papers) - len(unseen))
+            return not unseen or put(outbox, pd.DataFrame(unseen, columns=paper_columns), stop)
+
+        for concept_id in concept_ids:
+            for covered_from, covered_to in store.covered_ranges(concept_id, from_date, to_date):
+                for papers in store.iter_works(concept_id, covered_from, covered_to):
+                    metrics.count('fetch.rows_from_store', len(papers))
+                    if not send(papers):
+                        return
+
+        papers_fetched_so_far = 0
+        limit = 100000
+        on_page = lambda job, next_cursor, papers: store.save_page(*job, next_cursor, papers)
+        # Closed as soon as a downstream stage stops, which cancels the windows still in flight
+        with closing(harvest_papers(jobs, limit, session, rate_limiter, base_url=base_url, cursors=cursors, on_page=on_page)) as windows:
+            for job, papers_for_current_date in windows:
+                missing_concepts, window_from, window_to = job
+                store.save_window(missing_concepts, window_from, window_to, papers_for_current_date)
+                papers_fetched_so_far += len(papers_for_current_date)
+                metrics.count('fetch.windows')
+                metrics.count('fetch.rows_downloaded', len(papers_for_current_date))
+                date = window_from if window_from == window_to else f"{window_from} to {window_to}"
+                print(f"Papers fetched for {date}: {len(papers_for_current_date)}, {papers_fetched_so_far} of {total_papers_for_period} so far")
+                if timings is not None:
+                    timings['fetch'] = time.perf_counter() - started
+                if on_progress is not None:
+                    on_progress(papers_fetched_so_far, total_papers_for_period, date)
+                if job in cursors:
+                    # The pages fetched before the interruption are only in the store
+                    for concept_id in missing_concepts:
+                        for papers in store.iter_works(concept_id, window_from, window_to):
+                            if not send(papers):
+                                return
+                elif not send(papers_for_current_date):
+                    return
+
+        if timings is not None:
+            timings['fetch'] = time.perf_counter() - started
+        put(outbox, end_of_stream, stop)
+    except Exception as e:
+        put(outbox, e, stop)
+    finally:
+        if store is not None:
+            store.close()
+
+def filter_relevant(papers, matcher, relevant_only=tokenize_relevant_only, tokenize_pool=None):
+    with metrics.timer('filter.clean'):
+        papers['Cleaned Abstract'] = clean_texts(papers['Abstract'])
+    if not relevant_only:
+        with metrics.timer('filter.tokenize'):
+            papers['Tokens'] = tokenize_texts(papers['Cleaned Abstract'], tokenize_pool)
+    with metrics.timer('filter.match'):
+        matched_keywords = matcher.matched_keywords(papers['Cleaned Abstract'])
+    papers['Matched Keywords'] = matched_keywords.str.join(', ')
+    relevant_papers = papers[matched_keywords.str.len() > 0].copy()
+    if relevant_only:
+        with metrics.timer('filter.tokenize'):
+            relevant_papers['Tokens'] = tokenize_texts(relevant_papers['Cleaned Abstract'], tokenize_pool)
+    return relevant_papers
+
+def classify(relevant_papers, cache=None):
+    with metrics.timer('classify.sofc_pass'):
+        relevant_papers['SOFC Predictions'] = run_prediction(sofc_model_name, relevant_papers['Cleaned Abstract'] + separator, cache=cache)
+    positive_papers = relevant_papers[relevant_papers['SOFC Predictions'] == 'positive'].copy()
+    with metrics.timer('classify.materials_pass'):
+        positive_papers['SOFC Materials Predictions'] = run_prediction(sofc_materials_model_name, positive_papers['Cleaned Abstract'] + separator, cache=cache)
+    return positive_papers
+
+def score(positive_papers, target_embedding, cache=None, index=None):
+    embeddings = get_embeddings(positive_papers['Abstract'], cache)
+    if index is not None:
+        index.add(positive_papers['OpenAlex ID'].tolist(), embeddings)
+    positive_papers['embedding'] = list(embeddings)
+    positive_papers['similarity_score'] = cosine_similarities(embeddings, target_embedding)
+    return positive_papers
+
+def run_pipeline(concept_ids, from_date, to_date, target_embedding_word, keywords=keyword_sets['SOFC'], on_progress=None, base_url=openalex_base_url, on_timings=None, profile=False):
+    # Fetch -> clean and filter -> classify -> embed run as concurrent stages
+    # joined by bounded queues. Yields DataFrame chunks of positive, scored
+    # papers as soon as each one has been through every stage. on_timings
+    # receives the seconds spent in each stage so far after every chunk.
+    # Counters and latencies of the run are collected in metrics, and with
+    # profile every stage thread also runs under cProfile.
+    metrics.reset(profiling=profile)
+    cache = ModelCache()
+    index = VectorIndex()
+    target_embedding = get_embedding(target_embedding_word, cache)
+    matcher = KeywordMatcher(keywords)
+    tokenize_pool = create_tokenize_pool()
+    stop = threading.Event()
+    timings = {'fetch': 0.0, 'filter': 0.0, 'classify': 0.0, 'embed': 0.0}
+    fetched, relevant, positive, scored = [queue.Queue(maxsize=pipeline_queue_size) for _ in range(4)]
+    threads = [
+        threading.Thread(target=metrics.profiled(fetch_papers), args=(concept_ids, from_date, to_date, fetched, stop, on_progress, base_url, timings)),
+        threading.Thread(target=metrics.profiled(run_stage), args=(lambda papers: filter_relevant(papers, matcher, tokenize_pool=tokenize_pool), fetched, relevant, stop, timings, 'filter')),
+        threading.Thread(target=metrics.profiled(run_stage), args=(lambda papers: classify(papers, cache), relevant, positive, stop, timings, 'classify')),
+        threading.Thread(target=metrics.profiled(run_stage), args=(lambda papers: score(papers, target_embedding, cache, index), positive, scored, stop, timings, 'embed')),
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        while True:
+            chunk = scored.get()
+            if chunk is end_of_stream:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if on_timings is not None:
+                on_timings(dict(timings))
+            yield chunk
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if tokenize_pool is not None:
+            tokenize_pool.shutdown()
+        cache.close()
+        if on_timings is not None:
+            on_timings(dict(timings))
+
+def find_papers(concept_ids, from_date, to_date, target_embedding_word, keywords=keyword_sets['SOFC'], on_progress=None, output_format=output_format, output_path=None, on_timings=None, on_results=None, report_path=None, profile_path=None):
+    # Runs the whole pipeline and returns the positive papers ranked by similarity
+    # to the target word; on_results sees each unranked chunk as soon as it is
+    # scored. Unless output_format is None the ranked table is written at the end,
+    # and streaming formats append each chunk to <output>.partial until then.
+    # A JSON run report goes to report_path (by default next to the results),
+    # and with profile_path the merged cProfile stats of every stage go there.
+    path = None
+    partial_writer = None
+    timings = {}
+
+    def record_timings(stage_timings):
+        timings.update(stage_timings)
+        if on_timings is not None:
+            on_timings(stage_timings)
+
+    if output_format is not None:
+        metadata = {
+            'query': target_embedding_word,
+            'from_date': from_date,
+            'to_date': to_date,
+            'concepts': list(concept_ids),
+            'keywords': list(keywords),
+            'classifier_models': [sofc_model_name, sofc_materials_model_name],
+            'embedding_model': embedding_model_name,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        path = output_file_path(output_format, metadata, output_path)
+        if writers[output_format].streaming:
+            partial_writer = open_writer(output_format, {**metadata, 'order': 'arrival'}, path + '.partial')
+
+    results = []
+    try:
+        for chunk in run_pipeline(concept_ids, from_date, to_date, target_embedding_word, keywords, on_progress, on_timings=record_timings, profile=profile_path is not None):
+            results.append(chunk[result_columns])
+            if partial_writer is not None:
+                partial_writer.write(results[-1])
+            if on_results is not None:
+                on_results(results[-1])
+            print(f"Positive papers so far: {sum(len(result) for result in results)}")
+
+        papers = pd.concat(results) if results else pd.DataFrame(columns=result_columns)
+        # A full sort, not a top_k: the output file and the GUI table hold every positive paper in rank order
+        with metrics.timer('rank.latency'):
+            papers = papers.iloc[rank_by_score(papers['similarity_score'].to_numpy(dtype=float))]
+        print(papers)
+        if path is not None:
+            writer = open_writer(output_format, {**metadata, 'order': 'similarity_score descending'}, path)
+            writer.write(papers)
+            writer.close()
+            print(f"Results written to {path}")
+            if partial_writer is not None:
+                partial_writer.discard()
+                partial_writer = None
+        status = 'complete'
+    except BaseException as e:
+        status = f"failed: {type(e).__name__}: {e}"
+        raise
+    finally:
+        output = path if status == 'complete' else None
+        if partial_writer is not None:
+            partial_writer.close()
+            output = partial_writer.path
+            print(f"Partial results written to {output}")
+        if report_path is None and path is not None:
+            report_path = path + '.report.json'
+        if report_path is not None:
+            metrics.write_report(report_path, profile_path, status=status, stage_seconds=timings, output=output)
+            print(f"Run report written to {report_path}")
+    return papers
+
+def search_papers(query_word, top_k=50):
+    # Ranks every paper in the vector index against a query, without fetching or classifying anything
+    cache = ModelCache()
+    try:
+        query_embedding = get_embedding(query_word, cache)
+    finally:
+        cache.close()
+    scores = dict(VectorIndex().search(query_embedding, top_k))
+    store = WorkStore()
+    try:
+        papers = pd.DataFrame(store.get_works(list(scores)), columns=paper_columns)
+    finally:
+        store.close()
+    papers['similarity_score'] = papers['OpenAlex ID'].map(scores)
+    return papers[search_columns]
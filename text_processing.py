@@ -1,28 +1,43 @@
 import re
+import string
 import openai
 import time
+import random
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import pandas as pd
-from Constants import *
+from constants import *
 import requests
+from data_fetching import RateLimiter
+from metrics import metrics
 import numpy as np
-import nltk
-from nltk.stem import WordNetLemmatizer
 from dotenv import load_dotenv
 import os
 
-# Download NLTK resources
-nltk.download('wordnet')
-lemmatizer = WordNetLemmatizer()
+lemmatizer = None
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# Completions and embeddings can be pointed at another server, e.g. the benchmark's mock API
+openai.api_base = os.getenv("OPENAI_API_BASE", openai.api_base)
+
+clean_pattern = re.compile(r'[\W\d]')
+# Abstracts are ASCII after remove_non_printable_chars, so a translate table can replace the regex for them
+clean_table = str.maketrans({chr(code): ' ' for code in range(128) if clean_pattern.match(chr(code))})
+clean_lower_table = {**clean_table, **{ord(c): c.lower() for c in string.ascii_uppercase}}
 
 def clean_text(text):
     if not isinstance(text, str):
         return ""
-    text = re.sub(r'\W', ' ', text)
-    text = re.sub(r'\d', ' ', text)
-    return text
+    if text.isascii():
+        return text.translate(clean_table)
+    return clean_pattern.sub(' ', text)
+
+def clean_texts(texts):
+    # Batch version of clean_text followed by lowercase_text for a whole column
+    cleaned = [(text.translate(clean_lower_table) if text.isascii() else clean_pattern.sub(' ', text).lower()) if isinstance(text, str) else "" for text in texts]
+    return pd.Series(cleaned, index=texts.index, dtype=object)
 
 def lowercase_text(text):
     return text.lower()
@@ -33,47 +48,263 @@ def tokenize_text(text):
 def remove_stopwords(tokens):
     return [token for token in tokens if token not in stop_words]
 
+def get_lemmatizer():
+    # WordNet is loaded on first use, and only downloaded if it is not installed locally
+    global lemmatizer
+    if lemmatizer is None:
+        import nltk
+        from nltk.stem import WordNetLemmatizer
+        try:
+            nltk.data.find('corpora/wordnet')
+        except LookupError:
+            nltk.download('wordnet', quiet=True)
+        lemmatizer = WordNetLemmatizer()
+    return lemmatizer
+
+@functools.lru_cache(maxsize=lemma_cache_size)
+def lemmatize_token(token):
+    return get_lemmatizer().lemmatize(token)
+
 def lemmatize_tokens(tokens):
-    return [lemmatizer.lemmatize(token) for token in tokens]
+    return [lemmatize_token(token) for token in tokens]
+
+def tokenize_chunk(texts):
+    # tokenize -> remove stopwords -> lemmatize for a list of cleaned texts
+    return [[lemmatize_token(token) for token in text.split() if token not in stop_words] for text in texts]
+
+def create_tokenize_pool(processes=tokenize_processes):
+    # One pool for a whole run, so the workers load WordNet and fill their lemma caches once.
+    # Workers are spawned, not forked: they start while the other stage threads are running
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) if processes > 1 else None
+
+def tokenize_texts(texts, executor=None):
+    # Batch version of the tokenize/stopword/lemmatize chain for a whole column.
+    # Given a pool from create_tokenize_pool, columns of at least
+    # tokenize_parallel_threshold texts are split over its worker processes.
+    values = texts.tolist()
+    if executor is not None and len(values) >= tokenize_parallel_threshold:
+        chunks = [values[i:i + tokenize_chunk_size] for i in range(0, len(values), tokenize_chunk_size)]
+        tokens = [text_tokens for chunk_tokens in executor.map(tokenize_chunk, chunks) for text_tokens in chunk_tokens]
+    else:
+        tokens = tokenize_chunk(values)
+    return pd.Series(tokens, index=texts.index, dtype=object)
+
+class KeywordMatcher:
+    # All keywords compiled into one alternation, longest first, so a column is
+    # scanned once per abstract instead of once per keyword. Expects lowercase
+    # text such as the output of clean_texts.
+    def __init__(self, keywords=must_satisfy_keywords):
+        self.keywords = sorted(set(keyword.lower() for keyword in keywords), key=len, reverse=True)
+        self.pattern = re.compile('|'.join(re.escape(keyword) for keyword in self.keywords))
+
+    def is_relevant(self, abstract):
+        if not isinstance(abstract, str):
+            return False
+        return self.pattern.search(abstract) is not None
+
+    def find(self, abstract):
+        if not isinstance(abstract, str):
+            return []
+        first = self.pattern.search(abstract)
+        if first is None:
+            return []
+        return list(dict.fromkeys(self.pattern.findall(abstract, first.start())))
+
+    def matched_keywords(self, abstracts):
+        # Returns a column with the distinct keywords found in each abstract
+        return pd.Series([self.find(abstract) for abstract in abstracts], index=abstracts.index, dtype=object)
+
+default_matcher = KeywordMatcher()
 
 def is_relevant(abstract):
     if pd.isnull(abstract):  # Check if the abstract is NaN
         return False
-    return any(keyword in abstract.lower() for keyword in must_satisfy_keywords) # Make sure to check in lowercase
+    return default_matcher.is_relevant(abstract.lower()) # Make sure to check in lowercase
 
-def run_prediction(model_name, prompts):
-    predictions = []
-    for i, prompt in enumerate(prompts):
-        prediction = "Error"  # Default prediction in case of errors
-        try:
-            print(f"Processing prompt {i+1} of {len(prompts)}")
-            response = openai.Completion.create(
-                model=model_name,
-                prompt=prompt,
-                max_tokens=1,  # We only need the first token for classification
-                stop=stop_sequence
-            )
-            prediction = response.choices[0].text.strip()
-            print(f"Prediction: {prediction}")
-        except openai.error.InvalidRequestError:
-            print("Prompt too long. Skipping.")
-            prediction = "Prompt too long"
-        except openai.error.RateLimitError:
-            print("Rate limit exceeded. Sleeping for a bit.")
-            time.sleep(60)  # Sleep for 60 seconds
-        finally:
-            predictions.append(prediction)
+class OpenAICompletionBackend:
+    # Sends a batch of prompts as one completion request. Any callable taking
+    # (model_name, prompts) and returning one text per prompt can stand in,
+    # e.g. a client for a local mock server.
+    def __init__(self, api_base=None):
+        self.api_base = api_base
+
+    def __call__(self, model_name, prompts):
+        response = openai.Completion.create(
+            model=model_name,
+            prompt=prompts,
+            max_tokens=1,  # We only need the first token for classification
+            stop=stop_sequence,
+            api_base=self.api_base
+        )
+        if "usage" in response:
+            metrics.count('classify.api_tokens', response["usage"]["total_tokens"])
+        texts = [None] * len(prompts)
+        for choice in response.choices:
+            texts[choice["index"]] = choice["text"]
+        return texts
+
+class ClassificationEngine:
+    # Batches prompts into completion requests, keeps up to max_in_flight of
+    # them running and retries transient errors with exponential backoff and
+    # jitter. Requests are paced by an estimated tokens-per-minute budget.
+    retryable_errors = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout, openai.error.ServiceUnavailableError, openai.error.APIConnectionError)
+
+    def __init__(self, backend=None, batch_size=classification_batch_size, max_in_flight=classification_max_in_flight, tokens_per_minute=openai_tokens_per_minute, max_retries=classification_max_retries):
+        self.backend = backend or OpenAICompletionBackend()
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.token_budget = RateLimiter(tokens_per_minute / 60.0, tokens_per_minute)
+
+    def estimate_tokens(self, prompts):
+        # Roughly four characters per token, plus the one completion token
+        return sum(len(prompt) // 4 + 1 for prompt in prompts)
+
+    def complete(self, model_name, prompts):
+        for attempt in range(self.max_retries + 1):
+            with metrics.timer('classify.rate_limit_wait'):
+                self.token_budget.acquire(self.estimate_tokens(prompts))
+            metrics.count('classify.requests')
+            try:
+                with metrics.timer('classify.latency'):
+                    texts = self.backend(model_name, prompts)
+                return [text.strip() if text is not None else "Error" for text in texts]
+            except openai.error.InvalidRequestError:
+                metrics.count('classify.invalid_requests')
+                if len(prompts) > 1:
+                    # Find the offending prompt by sending the batch one by one
+                    return [prediction for prompt in prompts for prediction in self.complete(model_name, [prompt])]
+                print("Prompt too long. Skipping.")
+                return ["Prompt too long"]
+            except self.retryable_errors as e:
+                metrics.count('classify.errors')
+                if isinstance(e, openai.error.RateLimitError):
+                    metrics.count('classify.rate_limited')
+                if attempt == self.max_retries:
+                    print(f"Giving up on {len(prompts)} prompts after {attempt + 1} attempts: {e}")
+                    break
+                delay = random.uniform(0, min(60, 2 ** attempt))
+                print(f"{type(e).__name__}, retrying in {delay:.1f} seconds.")
+                metrics.count('classify.retries')
+                time.sleep(delay)
+        metrics.count('classify.failed_prompts', len(prompts))
+        return ["Error"] * len(prompts)
+
+    def run(self, model_name, prompts, on_batch=None):
+        # on_batch(batch_prompts, batch_predictions) sees every batch in order as soon as it is done
+        prompts = list(prompts)
+        batches = [prompts[i:i + self.batch_size] for i in range(0, len(prompts), self.batch_size)]
+        predictions = []
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            for i, batch_predictions in enumerate(executor.map(lambda batch: self.complete(model_name, batch), batches)):
+                predictions.extend(batch_predictions)
+                if on_batch is not None:
+                    on_batch(batches[i], batch_predictions)
+                print(f"Processed {min((i + 1) * self.batch_size, len(prompts))} of {len(prompts)} prompts")
+        return predictions
+
+default_engine = None
+
+def run_prediction(model_name, prompts, engine=None, cache=None):
+    global default_engine
+    if engine is None:
+        # Shared so every caller draws on the same token budget
+        if default_engine is None:
+            default_engine = ClassificationEngine()
+        engine = default_engine
+    prompts = list(prompts)
+    if cache is None:
+        return engine.run(model_name, prompts)
+
+    # Only prompts the cache has not seen go to the API. Every finished batch is
+    # cached straight away, so a run that fails halfway keeps what it has paid
+    # for and a rerun picks up after it; failures are not cached.
+    predictions = [value.decode('utf-8') if value is not None else None for value in cache.get_many(model_name, prompts)]
+    missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+    print(f"{len(prompts) - len(missing)} of {len(prompts)} predictions from cache")
+    metrics.count('classify.cache_hits', len(prompts) - len(missing))
+    metrics.count('classify.cache_misses', len(missing))
+
+    def checkpoint(batch_prompts, batch_predictions):
+        cacheable = [(prompt, prediction.encode('utf-8')) for prompt, prediction in zip(batch_prompts, batch_predictions) if prediction not in ("Error", "Prompt too long")]
+        if cacheable:
+            cache.put_many(model_name, *zip(*cacheable))
+
+    new_predictions = engine.run(model_name, [prompts[i] for i in missing], checkpoint)
+    for i, prediction in zip(missing, new_predictions):
+        predictions[i] = prediction
     return predictions
 
 headers = {
     'Content-Type': 'application/json',
     'Authorization': f'Bearer {openai.api_key}'
 }
+embedding_session = requests.Session()
+
+def post_embeddings(data, max_retries=embedding_max_retries):
+    # Same backoff with jitter as ClassificationEngine.complete; a 429 honours Retry-After
+    for attempt in range(max_retries + 1):
+        metrics.count('embed.requests')
+        try:
+            started = time.perf_counter()
+            response = embedding_session.post(f'{openai.api_base}/embeddings', headers=headers, json=data)
+            metrics.observe('embed.latency', time.perf_counter() - started)
+        except requests.exceptions.RequestException as e:
+            error, retry_after = e, None
+        else:
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                return response.json()
+            error, retry_after = f"HTTP {response.status_code}", response.headers.get('Retry-After')
+            if response.status_code == 429:
+                metrics.count('embed.rate_limited')
+        metrics.count('embed.errors')
+        if attempt == max_retries:
+            raise RuntimeError(f"Embeddings request failed after {attempt + 1} attempts: {error}")
+        delay = int(retry_after) if retry_after and retry_after.isdigit() else random.uniform(0, min(60, 2 ** attempt))
+        print(f"{error}, retrying embeddings in {delay:.1f} seconds.")
+        metrics.count('embed.retries')
+        time.sleep(delay)
+
+def get_embeddings(texts, cache=None, batch_size=embedding_batch_size):
+    # Returns one float32 row per text in a single contiguous matrix
+    texts = list(texts)
+    cached = cache.get_many(embedding_model_name, texts) if cache is not None else [None] * len(texts)
+    missing = [i for i, value in enumerate(cached) if value is None]
+    metrics.count('embed.cache_hits', len(texts) - len(missing))
+    metrics.count('embed.cache_misses', len(missing))
+    rows = [np.frombuffer(value, dtype=np.float32) if value is not None else None for value in cached]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        data = {
+            'input': [texts[i] for i in batch],
+            'model': embedding_model_name
+        }
+        body = post_embeddings(data)
+        if 'usage' in body:
+            metrics.count('embed.api_tokens', body['usage']['total_tokens'])
+        for item in body['data']:
+            rows[batch[item['index']]] = np.array(item['embedding'], dtype=np.float32)
+        if cache is not None:
+            cache.put_many(embedding_model_name, [texts[i] for i in batch], [rows[i].tobytes() for i in batch])
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack(rows)
+
+def get_embedding(text, cache=None):
+    return get_embeddings([text], cache)[0]
+
+def cosine_similarities(embeddings, target_embedding):
+    # One normalized matrix-vector product for the whole matrix
+    if len(embeddings) == 0:
+        return np.empty(0, dtype=np.float32)
+    target = target_embedding / np.linalg.norm(target_embedding)
+    return (embeddings @ target) / np.linalg.norm(embeddings, axis=1)
 
-def get_embedding(text):
-    data = {
-        'input': text,
-        'model': 'text-embedding-ada-002'
-    }
-    response = requests.post('https://api.openai.com/v1/embeddings', headers=headers, json=data)
-    return np.array(response.json()['data'][0]['embedding'])
\ No newline at end of file
+def rank_by_score(scores, top_k=None):
+    # Indices of the top_k highest scores, best first; all of them if top_k is None
+    scores = np.asarray(scores)
+    if top_k is None or top_k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, top_k)[:top_k]
+    return top[np.argsort(-scores[top], kind='stable')]
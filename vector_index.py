@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+from constants import vector_index_path, vector_index_block_size, vector_index_ivf_lists, vector_index_ivf_probes, embedding_model_name
+
+@contextmanager
+def file_lock(path):
+    # Exclusive lock across processes, held while a writer appends to the index
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class VectorIndex:
+    # Append-only float32 matrix of normalized embeddings on disk, memory-mapped
+    # for search, with the OpenAlex ID of every row kept alongside. An optional
+    # IVF layer (k-means centroids + row assignments) limits a search to the
+    # rows of the closest clusters for large corpora. Opening the index never
+    # writes to it; writers serialize on a lock file, and a reader only trusts
+    # the rows counted in index.json, so it can open the index mid-append.
+    def __init__(self, path=vector_index_path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.meta_file = os.path.join(path, 'index.json')
+        self.matrix_file = os.path.join(path, 'embeddings.f32')
+        self.ids_file = os.path.join(path, 'ids.txt')
+        self.lock_file = os.path.join(path, 'lock')
+        self.load()
+
+        self.centroids = None
+        self.assignments = None
+        if os.path.exists(os.path.join(path, 'centroids.npy')):
+            self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+            self.assignments = np.load(os.path.join(path, 'assignments.npy'))
+
+    def load(self):
+        # The metadata is read before the ids, which are always written first
+        self.meta = {'model': embedding_model_name, 'dimension': None, 'count': 0}
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file) as f:
+                self.meta = json.load(f)
+        if self.meta['model'] != embedding_model_name:
+            raise ValueError(f"Index at {self.path} holds {self.meta['model']} embeddings, not {embedding_model_name}")
+
+        # Lines past the count belong to an add that is still running or was interrupted
+        self.ids = []
+        if os.path.exists(self.ids_file):
+            with open(self.ids_file) as f:
+                self.ids = f.read().split()[:self.meta['count']]
+        self.ids_size = sum(len(work_id) + 1 for work_id in self.ids)
+        self.known_ids = set(self.ids)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def save_meta(self):
+        with open(self.meta_file + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self.meta_file + '.tmp', self.meta_file)
+
+    def add(self, ids, embeddings):
+        # Appends the embeddings of works not in the index yet
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock, file_lock(self.lock_file):
+            # Another process may have appended since this one last looked
+            if os.path.exists(self.meta_file):
+                with open(self.meta_file) as f:
+                    if json.load(f)['count'] != self.meta['count']:
+                        self.load()
+            if os.path.exists(self.ids_file) and os.path.getsize(self.ids_file) > self.ids_size:
+                # Drop the ids of an interrupted add; readers never look past the count
+                os.truncate(self.ids_file, self.ids_size)
+            new = []
+            seen = set()
+            for i, work_id in enumerate(ids):
+                if work_id not in self.known_ids and work_id not in seen:
+                    seen.add(work_id)
+                    new.append(i)
+            if not new:
+                return 0
+            rows = embeddings[new]
+            rows = rows / np.linalg.norm(rows, axis=1, keepdims=True)
+            if self.meta['dimension'] is None:
+                self.meta['dimension'] = rows.shape[1]
+            with open(self.matrix_file, 'r+b' if os.path.exists(self.matrix_file) else 'wb') as f:
+                f.seek(self.meta['count'] * self.meta['dimension'] * 4)
+                f.write(rows.astype(np.float32).tobytes())
+                f.truncate()
+            new_ids = [ids[i] for i in new]
+            with open(self.ids_file, 'a', newline='\n') as f:
+                f.write(''.join(f"{work_id}\n" for work_id in new_ids))
+            self.ids.extend(new_ids)
+            self.ids_size += sum(len(work_id) + 1 for work_id in new_ids)
+            self.known_ids.update(new_ids)
+            self.meta['count'] += len(new)
+            self.save_meta()
+            return len(new)
+
+    def matrix(self):
+        return np.memmap(self.matrix_file, dtype=np.float32, mode='r', shape=(self.meta['count'], self.meta['dimension']))
+
+    def build_ivf(self, n_lists=vector_index_ivf_lists, iterations=10, sample_size=100000, seed=0):
+        # Plain k-means on a sample of the rows; rows added later are searched exhaustively until the next build
+        with self.lock, file_lock(self.lock_file):
+            self.load()
+            self.fit_ivf(n_lists, iterations, sample_size, seed)
+
+    def fit_ivf(self, n_lists, iterations, sample_size, seed):
+        matrix = self.matrix()
+        rng = np.random.default_rng(seed)
+        sample = matrix[np.sort(rng.choice(len(matrix), min(sample_size, len(matrix)), replace=False))]
+        n_lists = min(n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = sample[nearest == list_id]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[list_id] = centroid / np.linalg.norm(centroid)
+        assignments = np.concatenate([np.argmax(matrix[start:start + vector_index_block_size] @ centroids.T, axis=1) for start in range(0, len(matrix), vector_index_block_size)])
+        np.save(os.path.join(self.path, 'centroids.npy'), centroids)
+        np.save(os.path.join(self.path, 'assignments.npy'), assignments)
+        self.centroids, self.assignments = centroids, assignments
+
+    def search(self, query_embedding, top_k=50, probes=vector_index_ivf_probes):
+        # Returns [(openalex_id, cosine similarity), ...], best first
+        if not len(self) or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        matrix = self.matrix()
+
+        candidates = None
+        if self.centroids is not None:
+            lists = np.argsort(-(self.centroids @ query))[:probes]
+            candidates = np.concatenate([np.flatnonzero(np.isin(self.assignments, lists)), np.arange(len(self.assignments), len(matrix))])
+        if candidates is not None and len(candidates):
+            scores = matrix[candidates] @ query
+        else:
+            # No IVF layer, or the probed lists are all empty: scan every row
+            candidates = None
+            scores = np.concatenate([matrix[start:start + vector_index_block_size] @ query for start in range(0, len(matrix), vector_index_block_size)])
+
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        rows = candidates[top] if candidates is not None else top
+        return [(self.ids[row], float(scores[i])) for row, i in zip(rows, top)]
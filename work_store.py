@@ -0,0 +1,187 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from constants import work_store_path, work_store_settle_days, work_store_max_age_days, work_store_checkpoint_max_age_days, work_store_chunk_size
+
+def concept_key(concept_ids):
+    # A single concept ID, or the IDs of a combined query joined in a fixed order
+    if isinstance(concept_ids, str):
+        return concept_ids.lower()
+    return '|'.join(sorted(concept_id.lower() for concept_id in concept_ids))
+
+class WorkStore:
+    # Local SQLite copy of harvested OpenAlex works, plus a record of which
+    # (concept, date window) ranges have been fetched completely. Windows still
+    # being fetched keep the cursor of their next page, so an interrupted run
+    # resumes them instead of starting over. Writes may come from any thread.
+    def __init__(self, path=work_store_path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS works (
+                id TEXT PRIMARY KEY,
+                doi TEXT,
+                title TEXT,
+                authors TEXT,
+                publication_date TEXT,
+                abstract TEXT,
+                concepts TEXT
+            );
+            CREATE TABLE IF NOT EXISTS work_concepts (
+                work_id TEXT,
+                concept_id TEXT,
+                PRIMARY KEY (work_id, concept_id)
+            );
+            CREATE TABLE IF NOT EXISTS fetched_windows (
+                concept_id TEXT,
+                from_date TEXT,
+                to_date TEXT,
+                fetched_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS window_cursors (
+                concept_id TEXT,
+                from_date TEXT,
+                to_date TEXT,
+                next_cursor TEXT,
+                papers_fetched INTEGER,
+                updated_at TEXT,
+                PRIMARY KEY (concept_id, from_date, to_date)
+            );
+            CREATE INDEX IF NOT EXISTS works_publication_date ON works (publication_date);
+            CREATE INDEX IF NOT EXISTS work_concepts_concept ON work_concepts (concept_id, work_id);
+            CREATE INDEX IF NOT EXISTS fetched_windows_concept ON fetched_windows (concept_id, from_date, to_date);
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def save_works(self, papers):
+        # papers are rows as returned by extract_papers_from_openalex_search; each is linked to the concept IDs in its last field
+        self.connection.executemany('INSERT OR REPLACE INTO works VALUES (?, ?, ?, ?, ?, ?, ?)', [paper[:7] for paper in papers])
+        self.connection.executemany('INSERT OR IGNORE INTO work_concepts VALUES (?, ?)', [(paper[0], concept_id.lower()) for paper in papers for concept_id in paper[7].split()])
+
+    def save_window(self, concept_ids, from_date, to_date, papers):
+        # Records the window as fetched completely for every concept of the query
+        if isinstance(concept_ids, str):
+            concept_ids = [concept_ids]
+        fetched_at = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.connection:
+            self.save_works(papers)
+            self.connection.executemany('INSERT INTO fetched_windows VALUES (?, ?, ?, ?)', [(concept_id.lower(), from_date, to_date, fetched_at) for concept_id in concept_ids])
+            self.connection.execute('DELETE FROM window_cursors WHERE concept_id = ? AND from_date = ? AND to_date = ?', (concept_key(concept_ids), from_date, to_date))
+
+    def save_page(self, concept_ids, from_date, to_date, next_cursor, papers):
+        # Checkpoint of a window still being fetched: its works so far and the cursor of the next page
+        concept_id = concept_key(concept_ids)
+        with self.lock, self.connection:
+            self.save_works(papers)
+            self.connection.execute('''
+                INSERT INTO window_cursors VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (concept_id, from_date, to_date) DO UPDATE SET
+                    next_cursor = excluded.next_cursor,
+                    papers_fetched = papers_fetched + excluded.papers_fetched,
+                    updated_at = excluded.updated_at
+            ''', (concept_id, from_date, to_date, next_cursor, len(papers), datetime.now().isoformat(timespec='seconds')))
+
+    def unfinished_windows(self, concept_ids, from_date, to_date):
+        # Returns [(from_date, to_date, next_cursor, papers_fetched), ...] for the
+        # interrupted windows of this query inside the period that can still be
+        # resumed. Checkpoints older than work_store_checkpoint_max_age_days are dropped.
+        cutoff = (datetime.now() - timedelta(days=work_store_checkpoint_max_age_days)).isoformat(timespec='seconds')
+        concept_id = concept_key(concept_ids)
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM window_cursors WHERE concept_id = ? AND updated_at < ?', (concept_id, cutoff))
+        windows = self.connection.execute('SELECT from_date, to_date, next_cursor, papers_fetched FROM window_cursors WHERE concept_id = ? AND from_date >= ? AND to_date <= ? ORDER BY from_date', (concept_id, from_date, to_date))
+        return windows.fetchall()
+
+    def is_fresh(self, to_date, fetched_at, now):
+        # Recent publications keep changing on OpenAlex for a while, so a window
+        # fetched before it had settled is only trusted for a short time.
+        if fetched_at - to_date >= timedelta(days=work_store_settle_days):
+            return True
+        return now - fetched_at < timedelta(days=work_store_max_age_days)
+
+    def coverage(self, concept_id, from_date, to_date, include_unfinished=False):
+        # One flag per day of the period: covered by a complete, fresh fetch for
+        # this concept, or with include_unfinished, by a window that can be resumed
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        end = datetime.strptime(to_date, "%Y-%m-%d")
+        now = datetime.now()
+        covered = [False] * ((end - start).days + 1)
+        windows = self.connection.execute('SELECT from_date, to_date, fetched_at FROM fetched_windows WHERE concept_id = ? AND from_date <= ? AND to_date >= ?', (concept_key(concept_id), to_date, from_date))
+        for window_from, window_to, fetched_at in windows:
+            window_end = datetime.strptime(window_to, "%Y-%m-%d")
+            if not self.is_fresh(window_end, datetime.fromisoformat(fetched_at), now):
+                continue
+            first = max((datetime.strptime(window_from, "%Y-%m-%d") - start).days, 0)
+            last = min((window_end - start).days, len(covered) - 1)
+            covered[first:last + 1] = [True] * (last - first + 1)
+        if include_unfinished:
+            for window_from, window_to, _, _ in self.unfinished_windows(concept_id, from_date, to_date):
+                first = (datetime.strptime(window_from, "%Y-%m-%d") - start).days
+                last = (datetime.strptime(window_to, "%Y-%m-%d") - start).days
+                covered[first:last + 1] = [True] * (last - first + 1)
+        return start, covered
+
+    def ranges_where(self, start, flags, wanted):
+        ranges = []
+        range_start = None
+        for day, flag in enumerate(flags + [not wanted]):
+            if flag == wanted and range_start is None:
+                range_start = day
+            elif flag != wanted and range_start is not None:
+                ranges.append(((start + timedelta(days=range_start)).strftime("%Y-%m-%d"), (start + timedelta(days=day - 1)).strftime("%Y-%m-%d")))
+                range_start = None
+        return ranges
+
+    def missing_ranges(self, concept_id, from_date, to_date, include_unfinished=False):
+        # Returns the [(from_date, to_date), ...] sub-ranges of the period not
+        # covered by a complete, fresh fetch for this concept.
+        start, covered = self.coverage(concept_id, from_date, to_date, include_unfinished)
+        return self.ranges_where(start, covered, False)
+
+    def missing_concept_ranges(self, concept_ids, from_date, to_date):
+        # Returns [(missing concept_ids, from_date, to_date), ...]: runs of days
+        # missing the same concepts, so each can be fetched with one combined query
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        coverage = [self.coverage(concept_id, from_date, to_date)[1] for concept_id in concept_ids]
+        runs = []
+        for day, covered in enumerate(zip(*coverage)):
+            missing = tuple(concept_id for concept_id, flag in zip(concept_ids, covered) if not flag)
+            if runs and runs[-1][0] == missing and runs[-1][2] == day - 1:
+                runs[-1][2] = day
+            elif missing:
+                runs.append([missing, day, day])
+        return [(missing, (start + timedelta(days=first)).strftime("%Y-%m-%d"), (start + timedelta(days=last)).strftime("%Y-%m-%d")) for missing, first, last in runs]
+
+    def covered_ranges(self, concept_id, from_date, to_date):
+        start, covered = self.coverage(concept_id, from_date, to_date)
+        return self.ranges_where(start, covered, True)
+
+    def iter_works(self, concept_id, from_date, to_date, chunk_size=work_store_chunk_size):
+        # Yields the stored works of a concept in the period, chunk_size rows at a time
+        cursor = self.connection.execute('''
+            SELECT works.id, works.doi, works.title, works.authors, works.publication_date, works.abstract, works.concepts, (
+                SELECT group_concat(linked.concept_id, ' ') FROM work_concepts AS linked WHERE linked.work_id = works.id
+            )
+            FROM works JOIN work_concepts ON work_concepts.work_id = works.id
+            WHERE work_concepts.concept_id = ? AND works.publication_date BETWEEN ? AND ?
+            ORDER BY works.publication_date DESC
+        ''', (concept_id.lower(), from_date, to_date))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [list(row) for row in rows]
+
+    def get_works(self, work_ids):
+        # Returns the stored rows for the given OpenAlex IDs, in the same order
+        found = {}
+        for i in range(0, len(work_ids), 500):
+            batch = work_ids[i:i + 500]
+            rows = self.connection.execute(f'''
+                SELECT id, doi, title, authors, publication_date, abstract, concepts, (SELECT group_concat(concept_id, ' ') FROM work_concepts WHERE work_id = works.id)
+                FROM works WHERE id IN ({",".join("?" * len(batch))})
+            ''', batch)
+            found.update((row[0], list(row)) for row in rows)
+        return [found[work_id] for work_id in work_ids if work_id in found]
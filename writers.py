@@ -0,0 +1,152 @@
+import csv
+import json
+import os
+import re
+from datetime import datetime
+from constants import output_directory
+
+# Every writer appends result chunks to its file and leaves a <output>.meta.json
+# file next to it describing the run. The output itself is always the final
+# table ranked by similarity_score, written once the run is complete; while it
+# runs, formats that can be appended to cheaply stream the chunks in arrival
+# order into <output>.partial, which is removed once the ranked output exists.
+# Writers for formats that cannot (Excel) set streaming = False.
+
+class ResultWriter:
+    extension = None
+    streaming = True
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.metadata = dict(metadata)
+        self.rows = 0
+
+    def write(self, papers):
+        self.rows += len(papers)
+
+    def close(self):
+        self.metadata['rows'] = self.rows
+        self.metadata['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        with open(self.path + '.meta.json', 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+
+    def discard(self):
+        # Closes a partial output whose rows have been written again in ranked order, and removes it
+        self.close()
+        for path in (self.path, self.path + '.meta.json'):
+            if os.path.exists(path):
+                os.remove(path)
+
+class CSVWriter(ResultWriter):
+    extension = 'csv'
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = None
+
+    def write(self, papers):
+        if self.writer is None:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(papers.columns)
+        self.writer.writerows(papers.itertuples(index=False))
+        self.file.flush()
+        super().write(papers)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+class JSONLWriter(ResultWriter):
+    extension = 'jsonl'
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, papers):
+        if len(papers):
+            lines = papers.to_json(orient='records', lines=True, force_ascii=False)
+            # Older pandas versions leave off the final newline
+            self.file.write(lines if lines.endswith('\n') else lines + '\n')
+            self.file.flush()
+        super().write(papers)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+class ParquetWriter(ResultWriter):
+    # Needs pyarrow; the run metadata is also stored in the Parquet schema
+    extension = 'parquet'
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow); choose another output format or install it")
+        self.pyarrow = pyarrow
+        self.writer = None
+
+    def write(self, papers):
+        table = self.pyarrow.Table.from_pandas(papers, preserve_index=False)
+        if self.writer is None:
+            # A column that is all None in the first chunk would otherwise be typed null for the whole file
+            fields = [self.pyarrow.field(field.name, self.pyarrow.string()) if field.type == self.pyarrow.null() else field for field in table.schema]
+            self.schema = self.pyarrow.schema(fields, metadata={b'paper_finder_run': json.dumps(self.metadata).encode('utf-8')})
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+        super().write(papers)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        super().close()
+
+class ExcelWriter(ResultWriter):
+    # openpyxl write-only workbook: rows are streamed to disk, run metadata goes on a second sheet
+    extension = 'xlsx'
+    streaming = False
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        from openpyxl import Workbook
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('Papers')
+        self.header_written = False
+
+    def write(self, papers):
+        if not self.header_written:
+            self.sheet.append(list(papers.columns))
+            self.header_written = True
+        for row in papers.itertuples(index=False):
+            self.sheet.append([value.item() if hasattr(value, 'item') else value for value in row])
+        super().write(papers)
+
+    def close(self):
+        run_sheet = self.workbook.create_sheet('Run')
+        for key, value in self.metadata.items():
+            run_sheet.append([key, json.dumps(value) if isinstance(value, (list, dict)) else value])
+        self.workbook.save(self.path)
+        super().close()
+
+writers = {writer.extension: writer for writer in (ParquetWriter, CSVWriter, JSONLWriter, ExcelWriter)}
+
+def output_file_path(output_format, metadata, path=None):
+    # Without a path every run gets its own timestamped file in output_directory
+    writer = writers[output_format]
+    if path is None:
+        os.makedirs(output_directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', metadata.get('query', '')).strip('-')[:40] or 'run'
+        stem = os.path.join(output_directory, f"{datetime.now():%Y%m%d-%H%M%S}_{slug}")
+        path = f"{stem}.{writer.extension}"
+        copy = 1
+        while os.path.exists(path):
+            copy += 1
+            path = f"{stem}-{copy}.{writer.extension}"
+    return path
+
+def open_writer(output_format, metadata, path=None):
+    return writers[output_format](output_file_path(output_format, metadata, path), metadata)